@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Shared pytest fixtures. Tests talk to a local `PTSimulator` and
+import the package as `pyflirpt` whatever the checkout is called.
+"""
+
+import importlib
+import os
+import sys
+
+import pytest
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+try:
+    import pyflirpt
+except ImportError:
+    # Checkout not installed: register it as the `pyflirpt` package
+    _spec = importlib.util.spec_from_file_location(
+        "pyflirpt", os.path.join(_ROOT, "__init__.py"), submodule_search_locations=[_ROOT])
+    pyflirpt = importlib.util.module_from_spec(_spec)
+    sys.modules["pyflirpt"] = pyflirpt
+    _spec.loader.exec_module(pyflirpt)
+
+
+@pytest.fixture
+def simulator():
+    """
+    A running PTSimulator, stopped after the test
+    """
+    from pyflirpt.utils.ptsimulator import PTSimulator
+    sim = PTSimulator()
+    sim.start()
+    yield sim
+    sim.stop()
@@ -9,10 +9,9 @@ import sys
 import signal
 import subprocess
 import time
-import csv
-from multiprocessing.pool import ThreadPool
-from collections import OrderedDict, deque
+from collections import OrderedDict
 from blessings import Terminal
+from pyflirpt.utils import ptconnection, ptdispatcher, ptjournal, ptprotocol, ptpresets
 
 
 # Pan and Tilt IP
@@ -33,6 +32,21 @@ TMIN = -2200
 PSMAX = 2000
 TSMAX = 2000
 
+# File holding the button presets
+PRESET_FILE = 'test.conf'
+
+# Maximum motion updates sent per second
+SEND_RATE = 40
+# Seconds to wait for the reply of a command
+REPLY_TIMEOUT = 5
+
+# Position axis values closer to the centre than this are ignored
+DEADZONE = 0.05
+# Axes driving the pan and tilt position
+POSITION_AXES = (0, 1)
+# Smallest change of an axis value that is acted upon
+CHANGE_THRESHOLD = 0.01
+
 # Boolean for Auth
 _is_authentic = False
 # Message if not Authenticated
@@ -57,13 +71,23 @@ class JoystickControl(object):
     Class containing the methods 
     to control the pan and tilt using
     compatible joysticks
+
+    Parameters
+    ----------
+    deadzone : float, optional
+        position axis values ignored around the centre
+    threshold : float, optional
+        smallest axis change acted upon
+    journal : str, optional
+        file to journal every command and reply to, replayable
+        with `python -m pyflirpt.utils.ptjournal`. Off by default
     """
     # GLOBALS:
     
     # Bool to enable storing positions when a special button
     # is pressed. Check _click() method.
     
-    def __init__(self):
+    def __init__(self, deadzone=DEADZONE, threshold=CHANGE_THRESHOLD, journal=None):
         self._is_authentic = _is_authentic
         self.term = Terminal()
         self._ok = self.term.green_bold('[PyFlirPT]: ')
@@ -71,10 +95,27 @@ class JoystickControl(object):
         pygame.init()
         self.Preset_Flag = False
         self.counter = 0
-        # Queue of commands to be sent
-        self.inst = deque(maxlen=5)
         self.current_pan = 0
         self.current_tilt = 0
+        # Axis jitter filter
+        self.deadzone = deadzone
+        self.threshold = threshold
+        self._last_axis = {}
+        # State of the controls, kept up to date from the events
+        self.buttons = {}
+        self.hat = (0, 0)
+        self.journal = ptjournal.Journal(journal) if journal else None
+        # Persistent connection shared by every command
+        self.conn = ptconnection.get_connection(PTip, PTport, via=HOST,
+                                                journal=self.journal)
+        # Open the ssh tunnel now so a HALT never waits on its handshake
+        self.conn.open()
+        # Every command goes through one sender: HALT first, then
+        # commands awaiting a reply, then the freshest motion target
+        self.dispatcher = ptdispatcher.CommandDispatcher(self.conn.execute,
+                                                         max_rate=SEND_RATE)
+        # Presets are read once, changes are saved in the background
+        self.presets = ptpresets.PresetStore(os.path.join(os.getcwd(), PRESET_FILE))
         
     def auth(self):
         p = subprocess.Popen(['gksudo', 'echo "Authenticated"'],
@@ -88,8 +129,18 @@ class JoystickControl(object):
         else:
             raise Exception(_non_auth_message)
 
+    def cleanup(self):
+        """
+        Send what is pending, save the presets and close the journal
+        """
+        self.dispatcher.stop()
+        self.presets.close()
+        if self.journal is not None:
+            self.journal.close()
+
     def exit_gracefully(self, signum, frame):
         signal.signal(signal.SIGINT, signal.getsignal(signal.SIGINT))
+        self.cleanup()
         try:
             print 'Ta-Ta'
             #if raw_input(self._err,'Exit? (y / n) > ').lower().startswith('y'):
@@ -130,50 +181,14 @@ class JoystickControl(object):
         '''
         return joystick
 
-    def _fileIO(self, fname, dic=None):
-        try:
-            with open(os.path.join(os.getcwd(), fname), 'r+') as f:
-                reader = csv.reader(f)
-                writer = csv.writer(f)
-                if dic:
-                    self.fdic = {rows[0]:rows[1] for rows in reader}
-                    print 'dic: ',dic
-                    print 'fdic: ', self.fdic
-                    if self.fdic == dic:
-                        print 'Nothing has changed!'
-                    else:
-                        self.fdic.update(dic)
-                        for k,v in self.fdic.items():
-                            writer.writerow([k, v])
-                    return self.fdic
-                else:
-                    #print 'No Dic passed'
-                    self.fdic = {rows[0]: rows[1] for rows in reader}
-                    return self.fdic
-                    
-        except IOError:
-            print self._err, 'Error Opening File'
-        finally:
-            reader = None
-            writer = None
-
     def _commandToPT(self, commands, btn=None):
-        self._params = None
+        """
+        Send the commands ahead of any queued motion and return
+        the replies. Used for commands whose reply is needed,
+        motion goes through `self.dispatcher.move`
+        """
         self.time = time.time()
-        #print self.counter
-        for i in commands:
-            if i not in self.inst:
-                self.inst.appendleft(i)
-                #print 'Command being sent: ',self.inst[0]
-                p = subprocess.Popen(['ssh',
-                                      HOST,
-                                      'echo -ne "{command} \n" | nc {PTip} {PTport}'.format(
-                                          command=self.inst[0],
-                                          PTip=PTip,
-                                          PTport=PTport
-                                      )], stdout=subprocess.PIPE)
-                out, err = p.communicate()
-                return out
+        return self.dispatcher.request(' '.join(commands)).result(REPLY_TIMEOUT)
 
     def _moveabs(self, axis, hat, btn0, btn1, posn):
         """
@@ -213,7 +228,7 @@ class JoystickControl(object):
             except Exception, e:
                 print 'Exception in panning and tilting: ',e
             finally:
-                self._commandToPT(self.command)
+                self.dispatcher.move(self.command)
                 self.command = []
                 btn1 == 0
                 #print 'Command: ',self.command
@@ -225,7 +240,7 @@ class JoystickControl(object):
             except Exception, e:
                 print 'Exception in setting axis speed', e
             finally:
-                self._commandToPT(self.command)
+                self.dispatcher.move(self.command)
                 self.command = []
                     
     def _click(self, btn, posn):
@@ -242,11 +257,7 @@ class JoystickControl(object):
         try:
             if btn == 0:
                 print 'HALT'
-                p = subprocess.Popen(['ssh', '128.122.72.97',
-                                      'echo -ne "H \n" | nc 192.168.1.50 4000'],
-                                     stdout=subprocess.PIPE)
-                out, err = p.communicate()
-                print out
+                print self.dispatcher.halt().result(REPLY_TIMEOUT)
 
             if btn == 1:
                 self.Preset_Flag = True
@@ -262,37 +273,26 @@ class JoystickControl(object):
                     #                      'echo -ne "PP \n TP \n" | nc 192.168.1.50 4000'],
                     #                     stdout=subprocess.PIPE)
                     #out, err = p.communicate()
-                    self.pan = int(out.split('\r')[5].split(' ')[-1])
-                    self.tilt = int(out.split('\r')[6].split(' ')[-1])
+                    self.pan, self.tilt = ptprotocol.query_values(out, 2)
                     
                     print 'SETTING PAN PRESET: ', self.pan
                     print 'SETTING TILT PRESET:', self.tilt
                     
-                    self.dic = {str(btn):'%s,%s'%(self.pan, self.tilt)}
+                    self.presets.set(btn, self.pan, self.tilt)
                     self.Preset_Flag = False
-                else:
-                    self.dic = None
-                    
-                pool = ThreadPool(processes=1)
-                async_result = pool.apply_async(self._fileIO, ('test.conf',self.dic))
-                return_val = async_result.get()
 
-                try:
-                    self.pan, self.tilt = return_val[str(btn)].split(',')
+                preset = self.presets.get(btn)
+                if preset is None:
+                    print 'No PRESET defined for this key'
+                else:
+                    self.pan, self.tilt = preset
                     print 'Pan: %s Tilt: %s'%(self.pan, self.tilt)
                     # Position the Pan and Tilt to the position in the preset
-                    # Let it be a separate code for now.
-                    # Later it will send list to _commandToPT method
-                    p = subprocess.Popen(['ssh', '128.122.72.97',
-                                          'echo -ne "PP%d \n TP%d \n" | nc 192.168.1.50 4000'%(
-                                              int(self.pan), int(self.tilt))],
-                                         stdout=subprocess.PIPE)
-                    out, err = p.communicate()
-                except KeyError:
-                    print 'No PRESET defined for this key'
-                finally:
-                    self.command = []
+                    self.dispatcher.move(['PP%d'%self.pan, 'TP%d'%self.tilt])
                     
+        except IOError, e:
+            # Error reply or no reply from the pan and tilt
+            print self._err, 'Command failed: ', e
         except NameError, KeyError:
             # NameError: If preset has never been set
             # KeyError: If preset has never been set and querried
@@ -309,40 +309,60 @@ class JoystickControl(object):
         #out, err = p.communicate()
         #print out.split('\r')[5:]
         
+    def _axisChanged(self, axis, value):
+        """
+        Returns True if the axis has moved by at least the change
+        threshold since it was last acted upon. The position axes
+        0 and 1 must also be outside the deadzone, the speed
+        throttle (axis 3) is meaningful across its whole range
+        """
+        if axis in POSITION_AXES and abs(value) < self.deadzone:
+            return False
+        last = self._last_axis.get(axis)
+        if last is not None and abs(value - last) < self.threshold:
+            return False
+        self._last_axis[axis] = value
+        return True
+
     def select_joystick(self, ids):
+        """
+        Process the events of joystick `ids` as they arrive.
+        Each event carries the control and value that changed,
+        motion is handed to the dispatcher so this loop
+        never waits on the pan and tilt
+        """
         signal.signal(signal.SIGINT, self.exit_gracefully)
-        # ToDo: Better way to store all controls in dictionary
-        # that is defined in initialized method
-
         joystick = self._initialize(ids)
-        #self.d = self._initialize(ids)
-        counter = 0
-        clock = pygame.time.Clock()
+        self.buttons = dict((i, joystick.get_button(i))
+                            for i in range(joystick.get_numbuttons()))
+        if joystick.get_numhats():
+            self.hat = joystick.get_hat(0)
+        self._last_axis = {}
         while 1:
-            for event in pygame.event.get():
-                if event.type == pygame.JOYBUTTONUP or event.type == pygame.JOYBUTTONDOWN:
-                    for i in range(joystick.get_numbuttons()):
-                        if joystick.get_button(i):
-                            self._click(i, joystick.get_button(i))
-                        
+            # Block until something happens, then take everything queued
+            events = [pygame.event.wait()] + pygame.event.get()
+            # Only the latest value of every axis in the burst matters
+            axes = OrderedDict()
+            for event in events:
+                if getattr(event, 'joy', ids) != ids:
+                    continue
+                if event.type == pygame.JOYBUTTONDOWN:
+                    self.buttons[event.button] = 1
+                    if event.button == 1:
+                        # Re-send the stick position once motion is enabled
+                        self._last_axis.clear()
+                    self._click(event.button, 1)
+                elif event.type == pygame.JOYBUTTONUP:
+                    self.buttons[event.button] = 0
+                elif event.type == pygame.JOYHATMOTION:
+                    if event.hat == 0:
+                        self.hat = event.value
                 elif event.type == pygame.JOYAXISMOTION:
-                    for i in range(joystick.get_numaxes()):
-                        if joystick.get_axis(i) and i != 2:
-                            counter +=1
-                            #print counter
-                            self._moveabs(i,
-                                       joystick.get_hat(0),
-                                       joystick.get_button(0),
-                                       joystick.get_button(1),
-                                       joystick.get_axis(i))
-            clock.tick(10)
-            #p = subprocess.Popen(['ssh', '128.122.72.97',
-            #                      'echo -ne "PP%d \n TP%d \n" |  nc 192.168.1.50 4000'%(
-            #                          int(joystick.get_axis(0)*4000),
-            #                          int(joystick.get_axis(1)*4000))],
-            #                     stdout=subprocess.PIPE)
-            
-            #out, err = p.communicate()
-            #print out.split('\r')[5:]
-            #time.sleep(2)
-        
+                    axes[event.axis] = event.value
+            for axis, value in axes.items():
+                if axis != 2 and self._axisChanged(axis, value):
+                    self._moveabs(axis,
+                                  self.hat,
+                                  self.buttons.get(0, 0),
+                                  self.buttons.get(1, 0),
+                                  value)
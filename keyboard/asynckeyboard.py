@@ -0,0 +1,325 @@
+# -* coding: utf-8 -*-
+"""
+asyncio counterpart of `KeyboardController` so that a single
+event loop can drive many pan and tilt heads at once.
+
+Usage:
+------
+async def main():
+    heads = [AsyncKeyboardController(ip, 4000) for ip in ips]
+    await asyncio.gather(*(head.connect() for head in heads))
+    await asyncio.gather(*(head.pan(100) for head in heads))
+"""
+
+import asyncio
+import socket
+import time
+from pyflirpt.utils import ptlogger, ptmetrics
+from pyflirpt.utils.ptbackoff import BackoffPolicy
+from pyflirpt.utils.ptprotocol import is_idempotent
+from pyflirpt.keyboard.status import PTStatus
+
+
+class AsyncKeyboardController(object):
+    """
+    Class containing coroutines to control the
+    FLIR E series pan and tilt over asyncio streams
+
+    Parameters
+    ----------
+    pt_ip : str
+        ip address of the pan and tilt
+    pt_port : int
+        port number of the pan and tilt
+    timeout : float, optional
+        seconds to wait for a connection or a reply (default: 2)
+    keepalive : float, optional
+        seconds of idleness after which a `B` query is sent to keep
+        the link warm. 0 disables it (default: 5)
+    reconnect_delay : float, optional
+        first delay of the default backoff between reconnect
+        attempts, in seconds (default: 1)
+    retries : int, optional
+        reconnect attempts per command before giving up (default: 3).
+        Commands that are not idempotent are never sent twice
+    backoff : ptbackoff.BackoffPolicy, optional
+        delays between reconnect attempts, overrides `reconnect_delay`
+    metrics : ptmetrics.Registry, optional
+        where to record latencies, retries and reconnects
+    """
+    def __init__(self, pt_ip, pt_port, timeout=2, keepalive=5,
+                 reconnect_delay=1, retries=3, metrics=None, backoff=None):
+        self.logger = ptlogger.ptlogger(tofile=True)
+        self.metrics = metrics if metrics is not None else ptmetrics.registry
+        self.PT_IP = pt_ip
+        self.PT_PORT = pt_port
+        self.cursor = b"*"
+        self.sentinel = b"\r\n"
+        # Max Pan and Tilt allowed
+        self.PPmax = 4000
+        self.PPmin = -4000
+        self.TPmax = 2100
+        self.TPmin = -2100
+        # Max Pan and Tilt speed
+        self.PSmax = 2000
+        self.TSmax = 2000
+        # Pan and Tilt speed set by resetPT
+        self.pan_speed = 150
+        self.tilt_speed = 150
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.reconnect_delay = reconnect_delay
+        self.backoff = backoff or BackoffPolicy(base=reconnect_delay, max_delay=30)
+        self.retries = retries
+        self.reader = None
+        self.writer = None
+        self._lock = asyncio.Lock()
+        self._keepalive_task = None
+        self._last_io = time.monotonic()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        await self.close()
+
+    async def _open(self):
+        """
+        Open the stream to the pan and tilt and consume its banner
+        """
+        self.logger.info("Opening connection to %s:%s" % (self.PT_IP, self.PT_PORT))
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.PT_IP, self.PT_PORT), self.timeout)
+        sock = self.writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.logger.debug(await asyncio.wait_for(
+            self.reader.readuntil(self.cursor+self.sentinel), self.timeout))
+        self._last_io = time.monotonic()
+
+    async def _close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await asyncio.wait_for(self.writer.wait_closed(), self.timeout)
+            except (asyncio.TimeoutError, OSError):
+                pass
+        self.reader = None
+        self.writer = None
+
+    async def _reconnect(self, attempt=0):
+        """
+        Close the stream and reopen it after the `backoff` delay of
+        retry number `attempt`, sleeping on the event loop (not the
+        thread)
+        """
+        self.logger.warning("Restarting connection to %s:%s" % (self.PT_IP, self.PT_PORT))
+        self.metrics.inc("pt_reconnects_total")
+        await self._close()
+        await asyncio.sleep(self.backoff.delay(attempt))
+        await self._open()
+
+    async def connect(self):
+        """
+        Connect to the pan and tilt, reset its speed and start
+        the keepalive task
+        """
+        await self._open()
+        if self.keepalive and self._keepalive_task is None:
+            self._keepalive_task = asyncio.ensure_future(self._keepAlive())
+        await self.resetPT()
+
+    async def close(self):
+        """
+        Stop the keepalive task and close the connection
+        """
+        self.logger.info("Quitting Control ")
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            try:
+                await self._keepalive_task
+            except asyncio.CancelledError:
+                pass
+            self._keepalive_task = None
+        await self._close()
+
+    async def _keepAlive(self):
+        while True:
+            await asyncio.sleep(self.keepalive)
+            if time.monotonic() - self._last_io >= self.keepalive:
+                try:
+                    await self.execute(b"B")
+                except Exception as ex:
+                    self.logger.warning("Keepalive failed: "+str(ex))
+
+    async def execute_many(self, commands):
+        """
+        Execute the commands on the device with a single write
+        and read the replies back in order
+
+        Parameters:
+        -----------
+        commands : list of bytes
+            commands to be executed on the pan and tilt
+
+        Returns:
+        --------
+        outputs : list of bytes
+            formatted replies, one per command
+
+        Raises:
+        -------
+        IOError
+            when the retries are spent, or after a failure if any of
+            the commands is not idempotent
+        """
+        commands = list(commands)
+        payload = b"".join(command+self.sentinel for command in commands)
+        async with self._lock:
+            for attempt in range(self.retries + 1):
+                try:
+                    if self.writer is None:
+                        await self._open()
+                    self.logger.debug("Executing: "+str(commands))
+                    start = time.monotonic()
+                    self.writer.write(payload)
+                    await asyncio.wait_for(self.writer.drain(), self.timeout)
+                    outputs = []
+                    for command in commands:
+                        outputs.append(await asyncio.wait_for(
+                            self.reader.readuntil(self.sentinel), self.timeout))
+                    self._last_io = time.monotonic()
+                    self.logger.debug("Replies  : %s "%outputs)
+                    if self.metrics.enabled:
+                        self.metrics.observe("pt_command_seconds", self._last_io - start,
+                                             command=ptmetrics.command_type(commands[0]))
+                    return outputs
+                except (OSError, EOFError, asyncio.TimeoutError,
+                        asyncio.IncompleteReadError) as ex:
+                    self.logger.warning("Command failed (%s): %r" % (str(commands), ex))
+                    if isinstance(ex, asyncio.TimeoutError):
+                        self.metrics.inc("pt_timeouts_total", kind="reply")
+                    if not all(is_idempotent(command) for command in commands):
+                        await self._close()
+                        raise IOError("Not resending %s after failure: %r" % (str(commands), ex))
+                    if attempt == self.retries:
+                        raise
+                    self.metrics.inc("pt_retries_total")
+                    try:
+                        await self._reconnect(attempt)
+                    except (OSError, asyncio.TimeoutError) as ex:
+                        self.logger.warning("Reconnect failed: %r" % ex)
+                        await self._close()
+
+    async def execute(self, command):
+        """
+        Execute the command on the device
+
+        Parameters:
+        -----------
+        command : bytes
+            command to be executed on the pan and tilt
+
+        Returns:
+        --------
+        output : bytes
+            formatted reply of the executed command
+        """
+        outputs = await self.execute_many([command])
+        return outputs[0]
+
+    async def status(self):
+        """
+        Returns the pan and tilt position and speed as a `PTStatus`
+        parsed from a single `B` query
+        """
+        return PTStatus.from_reply(await self.execute(b"B"))
+
+    async def ready(self):
+        """
+        Returns whether the pan and tilt
+        has finished executing previous pan or tilt command
+        """
+        return (await self.status()).ready
+
+    async def current_pos(self):
+        """
+        Returns current pan and tilt position as a tuple
+        (pan, tilt)
+        """
+        return (await self.status()).position
+
+    async def resetPT(self):
+        """
+        Method to reset the pan and tilt's speed
+        """
+        await self.execute_many([b'ED', b'CI',
+                                 b'PS'+str(self.pan_speed).encode(),
+                                 b'TS'+str(self.tilt_speed).encode(),
+                                 b'LU'])
+
+    async def pan(self, posn):
+        """
+        Method to pan the camera between the restricted
+        absolute positions `PPmin` and `PPmax`
+
+        Paramters:
+        ----------
+        posn : str
+            absolute position to pan the camera at
+        """
+        if self.PPmin <= int(posn) <= self.PPmax:
+            await self.execute(b"PP"+str(posn).encode())
+        else:
+            self.logger.warning("Cannot go beyond Limits ")
+
+    async def tilt(self, posn):
+        """
+        Method to tilt the camera between the restricted
+        absolute positions `TPmin` and `TPmax`
+
+        Paramters:
+        ----------
+        posn : str
+            absolute position to tilt the camera at
+        """
+        if self.TPmin <= int(posn) <= self.TPmax:
+            await self.execute(b"TP"+str(posn).encode())
+        else:
+            self.logger.warning("Cannot go beyond Limits ")
+
+    async def move_to(self, pan, tilt, pan_speed=None, tilt_speed=None):
+        """
+        Method to pan and tilt the camera together, sending
+        speeds and positions in a single packet
+
+        Paramters:
+        ----------
+        pan, tilt : int
+            absolute positions to move the camera to
+        pan_speed, tilt_speed : int
+            Optional. Speeds to set before moving
+
+        Returns:
+        --------
+        moved : bool
+            False if any argument is beyond the limits
+        """
+        pan, tilt = int(pan), int(tilt)
+        if not (self.PPmin <= pan <= self.PPmax and self.TPmin <= tilt <= self.TPmax):
+            self.logger.warning("Cannot go beyond Limits ")
+            return False
+        if (pan_speed is not None and not 0 < int(pan_speed) <= self.PSmax) or \
+           (tilt_speed is not None and not 0 < int(tilt_speed) <= self.TSmax):
+            self.logger.warning("Cannot go beyond Speed Limits ")
+            return False
+        commands = []
+        if pan_speed is not None:
+            commands.append(b"PS"+str(int(pan_speed)).encode())
+        if tilt_speed is not None:
+            commands.append(b"TS"+str(int(tilt_speed)).encode())
+        commands += [b"PP"+str(pan).encode(), b"TP"+str(tilt).encode()]
+        await self.execute_many(commands)
+        return True
@@ -3,26 +3,92 @@
 # June 08 2016
 # NYU CUSP 2016
 
-import telnetlib
 import atexit
 import sys
-import ast
 import time
 import logging
 import socket
-from telnetlib import IAC, NOP
-from pyflirpt.utils import ptlogger
-import traceback
+import threading
+from pyflirpt.utils import ptjournal, ptlogger, ptmetrics, ptprotocol
+from pyflirpt.utils.ptbackoff import BackoffPolicy
+from pyflirpt.utils.ptprotocol import IDEMPOTENT_COMMANDS, is_idempotent
+from pyflirpt.keyboard.status import PTStatus
+from pyflirpt.keyboard.kinematics import MotionModel
+from pyflirpt.keyboard.trajectory import TrajectoryReport, interpolate, segment_speeds
+from pyflirpt.keyboard.telemetry import TelemetryRecorder
+
+# Connection states
+CONNECTED = "connected"
+RECONNECTING = "reconnecting"
+CLOSED = "closed"
+
+class CommandBatch(object):
+    """
+    Context manager collecting commands issued through
+    `KeyboardController.execute` and sending them in one go
+    on exit. Replies are matched back to their commands in order.
+
+    Only commands whose reply is not needed inside the block
+    (moves, speed changes, mode settings) should be batched,
+    `execute` returns None while a batch is open, and `status()`
+    (hence `ready()`, `current_pos()` and `wait_until_ready()`)
+    raises RuntimeError. A batch only collects the commands of the
+    thread that opened it, and batches cannot be nested.
+
+    Usage:
+    ------
+    with kctrl.batch() as batch:
+        kctrl.pan(100)
+        kctrl.tilt(200)
+    batch.replies
+    """
+    def __init__(self, controller):
+        self.controller = controller
+        self.commands = []
+        self.replies = []
+
+    def add(self, command):
+        self.commands.append(command)
+
+    def __enter__(self):
+        if self.controller._batch is not None:
+            raise RuntimeError("A batch is already open")
+        self.controller._batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.controller._batch = None
+        if exc_type is None and self.commands:
+            self.replies = self.controller.execute_many(self.commands) or []
+
+    def __iter__(self):
+        return iter(zip(self.commands, self.replies))
 
 class KeyboardController(object):
     """
     Class containing methods to control the
     FLIR E series pan and tilt using the Keyboard
     """
-    def __init__(self, pt_ip, pt_port):
+    def __init__(self, pt_ip, pt_port, status_ttl=0.1, metrics=None,
+                 timeout=5, retries=3, reconnect_timeout=5, backoff=None,
+                 motion_model=None, journal=None):
         self.logger = ptlogger.ptlogger(tofile=True)
+        self.metrics = metrics if metrics is not None else ptmetrics.registry
         self.PT_IP = pt_ip
         self.PT_PORT = pt_port
+        # Seconds to wait for a reply
+        self.timeout = timeout
+        # Times a failed command is resent (idempotent commands only)
+        self.retries = retries
+        # Seconds a command waits for the background reconnect
+        self.reconnect_timeout = reconnect_timeout
+        self.backoff = backoff or BackoffPolicy(base=0.1, max_delay=5)
+        self.state = CONNECTED
+        self._connected = threading.Event()
+        self._state_lock = threading.Lock()
+        # Seconds for which a status snapshot can be reused
+        self.status_ttl = status_ttl
+        self._status = None
         self.cursor = b"*"
         self.sentinel = b"\r\n"
         # Max Pan and Tilt allowed
@@ -33,50 +99,94 @@ class KeyboardController(object):
         # Max Pan and Tilt speed
         self.PSmax = 2000
         self.TSmax = 2000
-        self.tn = self._openTelnet(self.PT_IP, self.PT_PORT)
+        # Pan and Tilt speed set by resetPT
+        self.pan_speed = 150
+        self.tilt_speed = 150
+        # Last commanded Pan and Tilt positions
+        self.target_pan = None
+        self.target_tilt = None
+        # Move duration model, calibrated by wait_until_ready
+        self.motion = motion_model or MotionModel()
+        # Default wait_until_ready timeout: expected move time
+        # times `timeout_factor` plus `timeout_margin` seconds
+        self.timeout_factor = 2.0
+        self.timeout_margin = 5.0
+        # Last position seen at rest and the move in progress as
+        # (start, target, pan speed, tilt speed, time sent)
+        self._position = None
+        self._move = None
+        # Fraction of the predicted move time by which the first
+        # poll comes early, widened whenever the move was already over
+        self._early = 0.05
+        # Open CommandBatch of each thread, if any, so that other
+        # threads (e.g. the telemetry sampler) are never batched
+        self._local = threading.local()
+        # Acknowledgements of commands sent without waiting
+        self._unread_replies = 0
+        # Held for every exchange on the connection, so that the
+        # telemetry thread never interleaves with control commands
+        self._io_lock = threading.Lock()
+        self.telemetry = None
+        # ptjournal.Journal recording every exchange, if any
+        self.journal = journal
+        self.conn = self._openConnection(self.PT_IP, self.PT_PORT)
+        self._connected.set()
         atexit.register(self.cleanup)
         self.resetPT()
 
-    def _openTelnet(self, host, port):
-        """                                                                                                                                                                                                 
-        Open Telnet connection with the host                                                                                                                                                                
-        Parameters                                                                                                                                                                                          
-        ----------                                                                                                                                                                                          
-        host : str                                                                                                                                                                                          
-            ip address of the host to connect to                                                                                                                                                            
-        port : int                                                                                                                                                                                          
-            port number to connect to                                                                                                                                                                      
-                                                                                                                                                                                                            
-        Returns                                                                                                                                                                                             
-        -------                                                                                                                                                                                             
-        tn : telnet object                                                                                                                                                                                  
-        """
-        self.logger.info("Opening Telnet connection")
-        tn = telnetlib.Telnet()
-        tn.open(host, port)
-        self.logger.debug(tn.read_until(self.cursor+self.sentinel))
-        # Keep Telnet socket Alive!
-        self._keepConnectionAlive(tn.sock)
-        return tn
-
-    def _closeTelnet(self, tn=None):
-        """                                                                                                                                                                                                 
-        Close the telnet connection.                                                                                                                                                                        
-                                                                                                                                                                                                            
-        Parameters                                                                                                                                                                                          
-        ----------                                                                                                                                                                                          
-        tn: Telnet object                                                                                                                                                                                   
-            Optional. If not passes, it will close the                                                                                                                                                      
-            existing telnet connection                                                                                                                                                                     
-                                                                                                                                                                                                            
+    @property
+    def _batch(self):
+        return getattr(self._local, "batch", None)
+
+    @_batch.setter
+    def _batch(self, batch):
+        self._local.batch = batch
+
+    def _openConnection(self, host, port):
+        """
+        Open a TCP connection with the host and
+        consume its banner
+
+        Parameters
+        ----------
+        host : str
+            ip address of the host to connect to
+        port : int
+            port number to connect to
+
+        Returns
+        -------
+        conn : FrameReader
+        """
+        self.logger.info("Opening connection")
+        conn = ptprotocol.FrameReader.connect(host, port, self.timeout)
+        try:
+            self.logger.debug(conn.read_until(self.cursor+self.sentinel))
+            # Keep socket Alive!
+            self._keepConnectionAlive(conn.sock)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _closeConnection(self, conn=None):
+        """
+        Close the connection.
+
+        Parameters
+        ----------
+        conn: FrameReader
+            Optional. If not passed, it will close the
+            existing connection
         """
+        conn = conn if conn else self.conn
+        if conn is None:
+            return
         try:
-            self.logger.warning("Closing Telnet connection")
-            tn = tn if tn else self.tn
-            tn.write(b'\x1d'+self.sentinel)
-            tn.close()
-        except Exception as ex:
-            self.logger.error("Error closing telnet: "+str(ex))
+            self.logger.warning("Closing connection")
+            conn.close()
+        except Exception:
+            self.logger.exception("Error closing connection")
 
     def _keepConnectionAlive(self, sock, idle_after_sec=1, interval_sec=3, max_fails=5):
         """
@@ -99,50 +209,157 @@ class KeyboardController(object):
         sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval_sec)
         sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, max_fails)
         
-    def _checkTelnetConnection(self, tnsock=None):
-        """                                                                            
-        Check the telnet connection is alive or not                            
+    def _checkConnection(self, sock=None):
+        """
+        Check the connection is alive or not
 
-        Parameters                                                                     
-        ----------                                                                     
-        tnsock: Telnet socket                                                  
+        Parameters
+        ----------
+        sock: TCP socket
+            Optional. Defaults to the current connection's
 
-        Returns           
-        -------                                                                        
-        True: bool                                                                          
-        if the connection is alive                                                
+        Returns
+        -------
+        True: bool
+        if the connection is alive
         """
+        sock = sock if sock else self.conn.sock
         try:
-            tnsock.sendall(IAC + NOP)
-            self.logger.debug("Detected Telnet connection is alive")
-            return True
+            # Closed connections read as empty without blocking
+            alive = sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b""
+        except BlockingIOError:
+            alive = True
         except Exception:
-            self.logger.warning("Detected Telnet connection is dead")
-            return False
+            alive = False
+        if alive:
+            self.logger.debug("Detected connection is alive")
+        else:
+            self.logger.warning("Detected connection is dead")
+        return alive
 
+    def _resetConnection(self, conn=None, wait=True):
+        """
+        Close the connection and
+        Reopen it in the background
 
-    def _resetTelnetConnection(self, tn=None):
-        """                                                                    
-        Close the Telnet connection and
-        Reopen them                                                            
+        Parameters
+        ----------
+        conn: FrameReader
+            Optional. If not passed, it will close and reopen
+            the existing connection
+        wait: bool
+            Block until the connection is back, at most
+            `reconnect_timeout` seconds (default: True)
+        """
+        # The I/O lock first, so the connection is never dropped
+        # under an exchange in progress on another thread
+        with self._io_lock, self._state_lock:
+            if self.state == CONNECTED:
+                self.logger.warning("Restarting connection")
+                conn = conn if conn else self.conn
+                self.state = RECONNECTING
+                self._connected.clear()
+                self.conn = None
+                self._unread_replies = 0
+                self.invalidate_status()
+                thread = threading.Thread(target=self._reconnectLoop, args=(conn,),
+                                          name="PTReconnect")
+                thread.daemon = True
+                thread.start()
+        if wait:
+            self._awaitConnection()
+
+    def _reconnectLoop(self, conn):
+        """
+        Reopen the connection, backing off between attempts,
+        until it succeeds or the controller is cleaned up
+        """
+        start = time.perf_counter()
+        self.metrics.inc("pt_reconnects_total")
+        if conn is not None:
+            self._closeConnection(conn)
+        attempt = 0
+        while self.state == RECONNECTING:
+            try:
+                new_conn = self._openConnection(self.PT_IP, self.PT_PORT)
+            except (IOError, EOFError) as ex:
+                delay = self.backoff.delay(attempt)
+                attempt += 1
+                self.logger.warning("Reconnect attempt %d failed (%s), next in %.2fs" % (
+                    attempt, str(ex), delay))
+                time.sleep(delay)
+                continue
+            with self._state_lock:
+                if self.state != RECONNECTING:
+                    self._closeConnection(new_conn)
+                    return
+                self.conn = new_conn
+                self.state = CONNECTED
+                self._connected.set()
+            self.logger.info("Reconnected after %d failed attempts" % attempt)
+            self.metrics.observe("pt_reconnect_seconds", time.perf_counter() - start)
+
+    def _awaitConnection(self):
+        """
+        Wait for the background reconnect
+
+        Raises
+        ------
+        IOError
+            if the connection is not back within `reconnect_timeout`
+        """
+        if not self._connected.wait(self.reconnect_timeout) or self.conn is None:
+            self.metrics.inc("pt_timeouts_total", kind="reconnect")
+            raise IOError("Pan and tilt at %s:%s unreachable" % (self.PT_IP, self.PT_PORT))
+
+    def _readReply(self):
+        """
+        Read one reply, raising socket.timeout if it does not
+        arrive within `timeout` seconds
+        """
+        return self.conn.read_frame()
+
+    def _withRetry(self, commands, send):
+        """
+        Call `send` and on a connection failure reconnect and call
+        it again, at most `retries` times. Commands that are not
+        idempotent are never sent twice
+
+        Raises
+        ------
+        IOError
+            when the retry budget is spent, the connection cannot be
+            restored or a non idempotent command may have been lost
+        """
+        attempt = 0
+        while True:
+            if self.conn is None:
+                self._awaitConnection()
+            try:
+                with self._io_lock:
+                    # Reset by another thread since the check above
+                    if self.conn is None:
+                        raise IOError("Connection to %s:%s was reset" % (self.PT_IP, self.PT_PORT))
+                    return send()
+            except (IOError, EOFError) as ex:
+                if isinstance(ex, socket.timeout):
+                    self.metrics.inc("pt_timeouts_total", kind="reply")
+                self.metrics.inc("pt_errors_total", kind="io")
+                self.logger.warning("Executing %s failed: %s" % (str(commands), str(ex)))
+                if not all(is_idempotent(command) for command in commands):
+                    self._resetConnection(self.conn, wait=False)
+                    raise IOError("Not resending %s after failure: %s" % (str(commands), str(ex)))
+                if attempt == self.retries:
+                    self._resetConnection(self.conn, wait=False)
+                    raise IOError("Giving up on %s after %d retries: %s" % (
+                        str(commands), attempt, str(ex)))
+                self._resetConnection(self.conn)
+                attempt += 1
+                self.metrics.inc("pt_retries_total")
 
-        Parameters                                                                     
-        ----------                                                                     
-        tn: Telnet object                                                                  
-            Optional. If not passed, it will close and reopen                              
-            the existing telnet connection                                             
-            ..Note: This will make all the old telnet objects point                             
-            to the new object                                                         
-        """
-        self.logger.warning("Restarting Telnet connection")
-        self._closeTelnet(tn)
-        self.tn = None
-        time.sleep(1)
-        self.tn = self._openTelnet(self.PT_IP, self.PT_PORT)
-        
     def execute(self, command):
         """
-        Execute the telnet command on the device
+        Execute the command on the device
         by performing appropriate addition of sentinels
         and padding
 
@@ -155,22 +372,159 @@ class KeyboardController(object):
         --------
         output : str
             formatted reply of the executed command
+
+        Raises:
+        -------
+        IOError
+            if the command could not be executed (see `_withRetry`)
         """
-        try:
+        if self._batch is not None:
+            self._batch.add(command)
+            return None
+        def _send():
+            start = time.perf_counter()
+            self._drainReplies()
             self.logger.debug("Executing: "+str(command))
-            self.tn.write(command+self.sentinel)
-            output = self.tn.read_until(self.sentinel)
+            sent = time.time()
+            self.conn.write(command+self.sentinel)
+            output = self._exchangeReplies(command, sent, 1)
             self.logger.debug("Reply    : %s "%output)
+            if self.metrics.enabled:
+                self.metrics.observe("pt_command_seconds", time.perf_counter() - start,
+                                     command=ptmetrics.command_type(command))
             return output
-        except IOError as io:
-            # restart PT
-            self._resetTelnetConnection(self.tn)
-            self.execute(command)
-        except Exception as ex:
-            self.logger.error("Exception: "+str(ex))
-            
-            
-    def ready(self):
+        try:
+            return self._withRetry([command], _send)
+        except IOError:
+            raise
+        except Exception:
+            self.metrics.inc("pt_errors_total", kind="other")
+            self.logger.exception("Executing %s failed" % str(command))
+            raise
+
+    def execute_many(self, commands):
+        """
+        Execute several commands on the device with a
+        single write and read the replies back in order, so the
+        whole batch costs one round trip instead of one per command
+
+        Parameters:
+        -----------
+        commands : list of str
+            commands to be executed on the pan and tilt
+
+        Returns:
+        --------
+        outputs : list of str
+            formatted replies, one per command, in the same order
+
+        Raises:
+        -------
+        IOError
+            if the commands could not be executed (see `_withRetry`)
+        """
+        commands = list(commands)
+        def _send():
+            start = time.perf_counter()
+            self._drainReplies()
+            self.logger.debug("Executing: "+str(commands))
+            sent = time.time()
+            self.conn.write(b"".join(command+self.sentinel for command in commands))
+            outputs = self._exchangeReplies(b" ".join(commands), sent, len(commands))
+            self.logger.debug("Replies  : %s "%outputs)
+            if self.metrics.enabled:
+                self.metrics.observe("pt_batch_seconds", time.perf_counter() - start)
+                self.metrics.inc("pt_batched_commands_total", len(commands))
+            return outputs
+        try:
+            return self._withRetry(commands, _send)
+        except IOError:
+            raise
+        except Exception:
+            self.metrics.inc("pt_errors_total", kind="other")
+            self.logger.exception("Executing %s failed" % str(commands))
+            raise
+
+    def _exchangeReplies(self, command, sent, count):
+        """
+        Read the replies of `count` commands written at `sent`,
+        journaling the exchange. Returns the reply of a single
+        command, the list of replies otherwise
+        """
+        if self.journal is None:
+            if count == 1:
+                return self._readReply()
+            return [self._readReply() for i in range(count)]
+        outputs = []
+        try:
+            for i in range(count):
+                outputs.append(self._readReply())
+        except Exception:
+            self.journal.record(command, b"".join(outputs), sent, time.time(), ptjournal.FAILED)
+            raise
+        self.journal.record(command, b"".join(outputs), sent, time.time())
+        return outputs[0] if count == 1 else outputs
+
+    def _drainReplies(self):
+        """
+        Read the acknowledgements of commands sent with `wait=False`
+        so that replies stay matched to their commands
+        """
+        while self._unread_replies:
+            self.logger.debug("Ack      : %s "%self._readReply())
+            self._unread_replies -= 1
+
+    def batch(self):
+        """
+        Returns a `CommandBatch` context manager. Commands executed
+        inside the block are pipelined and sent together on exit
+        """
+        return CommandBatch(self)
+
+    def status(self, max_age=None, cache=True):
+        """
+        Returns the pan and tilt status, querying the module only
+        if the cached snapshot is older than `max_age`
+
+        Parameters:
+        -----------
+        max_age : float
+            Optional. Maximum age in seconds of a cached snapshot.
+            Defaults to `status_ttl`, 0 forces a fresh query
+        cache : bool
+            Keep a fresh snapshot for later calls (default: True).
+            Background readers pass False, so that a snapshot taken
+            just before a move is never mistaken for the new state
+
+        Returns:
+        --------
+        status : PTStatus
+            position and speed of the pan and tilt
+
+        Raises:
+        -------
+        RuntimeError
+            if called inside a batch, where no reply can be read
+        """
+        if self._batch is not None:
+            raise RuntimeError("Cannot query the status inside a batch")
+        max_age = self.status_ttl if max_age is None else max_age
+        status = self._status
+        if status is None or status.age() > max_age:
+            status = PTStatus.from_reply(self.execute(b"B"))
+            if cache:
+                self._status = status
+        else:
+            self.metrics.inc("pt_status_cache_hits_total")
+        return status
+
+    def invalidate_status(self):
+        """
+        Drop the cached status so the next query hits the module
+        """
+        self._status = None
+
+    def ready(self, max_age=None):
         """
         Returns whether the pan and tilt
         has finished executing previous pan or tilt command
@@ -178,29 +532,180 @@ class KeyboardController(object):
         ready : bool
             True if the module is ready
         """
+        return self.status(max_age).ready
 
-        command = b"B"
-        output = self.execute(command)
-        if output.strip().split()[2] == b'S(0,0)':
-            return True
-        else:
-            return False
-
-    def current_pos(self):
+    def current_pos(self, max_age=None):
         """
         Returns current pan and tilt position as a tuple
         (pan, tilt)
         """
-        command = b"B"
-        output = self.execute(command)
-        return ast.literal_eval(output.strip().split()[1].decode("ascii").strip('P'))
-        
+        return self.status(max_age).position
+
     def resetPT(self):
         """
         Method to reset the pan and tilt's speed
         """
-        commands = [b'ED', b'CI', b'PS150', b'TS150', b'LU']
-        map(lambda x: self.execute(x), commands)
+        commands = [b'ED', b'CI',
+                    b'PS'+str(self.pan_speed).encode(),
+                    b'TS'+str(self.tilt_speed).encode(),
+                    b'LU']
+        self.execute_many(commands)
+
+    def estimate_move_time(self, target=None, start=None, pan_speed=None, tilt_speed=None):
+        """
+        Predict how long a move takes with the calibrated motion model
+
+        Parameters:
+        -----------
+        target : (pan, tilt)
+            Optional. Defaults to the last commanded position
+        start : (pan, tilt)
+            Optional. Defaults to the last position seen at rest,
+            or the current position if unknown
+        pan_speed, tilt_speed : int
+            Optional. Default to the configured speeds
+
+        Returns:
+        --------
+        seconds : float
+            expected duration of the move
+        """
+        if start is None:
+            start = self._position if self._position is not None else self.current_pos(max_age=0)
+        if target is None:
+            target = (self.target_pan, self.target_tilt)
+        target = (start[0] if target[0] is None else target[0],
+                  start[1] if target[1] is None else target[1])
+        return self.motion.estimate(start, target,
+                                    pan_speed or self.pan_speed,
+                                    tilt_speed or self.tilt_speed)
+
+    def _startMove(self):
+        """
+        Remember when the last commanded move was sent and from where
+        """
+        start = self._position if self._move is None else None
+        self._move = (start, (self.target_pan, self.target_tilt),
+                      self.pan_speed, self.tilt_speed, time.time())
+        self._position = None
+
+    def _expectedArrival(self):
+        """
+        time.time() at which the move in progress should end, None
+        if its starting point is unknown
+        """
+        if self._move is None or self._move[0] is None:
+            return None
+        start, target, pan_speed, tilt_speed, sent = self._move
+        return sent + self.estimate_move_time(target, start, pan_speed, tilt_speed)
+
+    def _finishMove(self, status, arrived):
+        """
+        Record the position at rest and calibrate the motion model
+        with the measured duration of the move. `arrived` is None
+        if the arrival time is not known
+        """
+        if arrived is not None and self._move is not None and self._move[0] is not None:
+            start, target, pan_speed, tilt_speed, sent = self._move
+            target = (start[0] if target[0] is None else target[0],
+                      start[1] if target[1] is None else target[1])
+            predicted = self.motion.estimate(start, target, pan_speed, tilt_speed)
+            self.motion.observe(start, target, pan_speed, tilt_speed, arrived - sent)
+            self.metrics.observe("pt_eta_error_seconds", abs(arrived - sent - predicted))
+        self._move = None
+        self._position = status.position
+
+    def wait_until_ready(self, timeout=None, poll_strategy="predictive",
+                         min_interval=0.05, max_interval=1.0):
+        """
+        Block until the pan and tilt has finished executing previous
+        pan or tilt command, polling with backoff instead of spinning
+
+        Parameters:
+        -----------
+        timeout : float
+            maximum seconds to wait. Defaults to the expected move
+            time times `timeout_factor` plus `timeout_margin`
+        poll_strategy : str {'fixed', 'exponential', 'predictive'}
+            fixed: poll every `min_interval`
+            exponential: start at `min_interval` and double the
+            interval up to `max_interval`
+            predictive: skip polling until just before the arrival
+            predicted by the motion model and then poll
+            exponentially (default: predictive)
+        min_interval : float
+            shortest interval between polls in seconds
+        max_interval : float
+            longest interval between polls in seconds
+
+        Returns:
+        --------
+        (ready, polls) : tuple
+            whether the module became ready before `timeout`
+            and the number of status queries it took
+        """
+        if poll_strategy not in ("fixed", "exponential", "predictive"):
+            raise ValueError("Unknown poll strategy: "+str(poll_strategy))
+        start = time.time()
+        arrival = self._expectedArrival()
+        deadline = None
+        if timeout is not None:
+            deadline = start + timeout
+        elif arrival is not None:
+            deadline = start + max(arrival - start, 0) * self.timeout_factor + self.timeout_margin
+        if poll_strategy == "predictive" and arrival is not None:
+            # Wake up a little early so arrival is not overshot
+            wake = arrival - max(min_interval, self._early * (arrival - self._move[4]))
+            if wake > start:
+                time.sleep(min(wake, deadline) - start)
+        polls = 0
+        interval = min_interval
+        polled = self._move[4] if self._move is not None else start
+        while True:
+            polls += 1
+            asked = time.time()
+            status = self.status(max_age=0)
+            if status.ready:
+                ready = True
+                if polls == 1 and arrival is not None:
+                    # Already there, the arrival time is unknown. Come
+                    # earlier next time so that it can be measured
+                    self._early = min(self._early * 2, 0.5)
+                    self._finishMove(status, None)
+                else:
+                    # Arrived between this poll and the previous one
+                    if polls > 1:
+                        self._early = max(self._early / 1.5, 0.05)
+                    self._finishMove(status, (polled + status.timestamp) / 2.0)
+                break
+            polled = asked
+            if polls == 1 and (arrival is None or deadline is None):
+                eta = self.estimate_move_time(start=status.position)
+                if deadline is None:
+                    deadline = asked + eta * self.timeout_factor + self.timeout_margin
+                if poll_strategy == "predictive":
+                    eta -= max(min_interval, 0.05 * eta)
+                    if eta > 0:
+                        time.sleep(min(eta, max(deadline - time.time(), 0)))
+                        continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                ready = False
+                self.logger.warning("Timed out waiting for PT module")
+                break
+            time.sleep(min(interval, remaining))
+            if poll_strategy == "exponential":
+                interval = min(interval * 2, max_interval)
+            elif poll_strategy == "predictive" and (arrival is None or time.time() > arrival):
+                # Keep polling quickly up to the predicted arrival
+                interval = min(interval * 2, max_interval)
+        self.logger.debug("Ready after %d polls" % polls)
+        if self.metrics.enabled:
+            self.metrics.inc("pt_ready_polls_total", polls, strategy=poll_strategy)
+            self.metrics.observe("pt_ready_wait_seconds", time.time() - start)
+            if not ready:
+                self.metrics.inc("pt_timeouts_total", kind="ready")
+        return ready, polls
 
     def pan(self, posn):
         """
@@ -219,6 +724,9 @@ class KeyboardController(object):
         if self.PPmin <= int(posn) <= self.PPmax:
             command = b"PP"+str(posn).encode()
             self.execute(command)
+            self.target_pan = int(posn)
+            self._startMove()
+            self.invalidate_status()
         else:
             self.logger.warning("Cannot go beyond Limits ")
 
@@ -239,14 +747,206 @@ class KeyboardController(object):
         if self.TPmin <= int(posn) <= self.TPmax:
             command = b"TP"+str(posn).encode()
             self.execute(command)
+            self.target_tilt = int(posn)
+            self._startMove()
+            self.invalidate_status()
         else:
             self.logger.warning("Cannot go beyond Limits ")
 
+    def move_to(self, pan, tilt, pan_speed=None, tilt_speed=None, wait=True):
+        """
+        Method to pan and tilt the camera together. Speeds and
+        positions go out in a single packet so both axes start
+        moving at the same instant
+
+        Parameters:
+        -----------
+        pan : int
+            absolute position to pan the camera at
+        tilt : int
+            absolute position to tilt the camera at
+        pan_speed : int
+            Optional. Pan speed to set before moving
+        tilt_speed : int
+            Optional. Tilt speed to set before moving
+        wait : bool
+            Wait for the immediate-execution acknowledgement of
+            every command (default: True). If False the
+            acknowledgements are read before the next command
+
+        Returns:
+        --------
+        moved : bool
+            False if any argument is beyond the limits, in which
+            case nothing is sent
+        """
+        pan, tilt = int(pan), int(tilt)
+        if not (self.PPmin <= pan <= self.PPmax and self.TPmin <= tilt <= self.TPmax):
+            self.logger.warning("Cannot go beyond Limits ")
+            return False
+        if (pan_speed is not None and not 0 < int(pan_speed) <= self.PSmax) or \
+           (tilt_speed is not None and not 0 < int(tilt_speed) <= self.TSmax):
+            self.logger.warning("Cannot go beyond Speed Limits ")
+            return False
+        commands = []
+        if pan_speed is not None:
+            self.pan_speed = int(pan_speed)
+            commands.append(b"PS"+str(self.pan_speed).encode())
+        if tilt_speed is not None:
+            self.tilt_speed = int(tilt_speed)
+            commands.append(b"TS"+str(self.tilt_speed).encode())
+        commands += [b"PP"+str(pan).encode(), b"TP"+str(tilt).encode()]
+        if self._batch is not None:
+            for command in commands:
+                self._batch.add(command)
+        elif wait:
+            self.execute_many(commands)
+        else:
+            def _send():
+                self._drainReplies()
+                self.logger.debug("Executing: "+str(commands))
+                sent = time.time()
+                self.conn.write(b"".join(command+self.sentinel for command in commands))
+                self._unread_replies += len(commands)
+                if self.journal is not None:
+                    self.journal.record(b" ".join(commands), b"", sent, sent, ptjournal.NOWAIT)
+            self._withRetry(commands, _send)
+        self.target_pan = pan
+        self.target_tilt = tilt
+        self._startMove()
+        self.invalidate_status()
+        return True
+
+    def follow_trajectory(self, waypoints, lead=0.1):
+        """
+        Stream timestamped waypoints so that the pan and tilt moves
+        through them without stopping
+
+        The module is first brought to the first waypoint. From then
+        on every waypoint is sent `lead` seconds before the previous
+        one is due, with the pan and tilt speeds that reach it on
+        time, so the target changes while the head is still moving.
+        Before each send the position is queried and compared with
+        where the trajectory says it should be. Returns once the last
+        waypoint is reached, with the pan and tilt speeds set back
+        to what they were before
+
+        Parameters:
+        -----------
+        waypoints : iterable of (t, pan, tilt)
+            seconds from the first waypoint and absolute position,
+            e.g. a generator. `t` must not decrease
+        lead : float
+            seconds ahead of the previous waypoint at which the next
+            one is sent (default: 0.1)
+
+        Returns:
+        --------
+        report : trajectory.TrajectoryReport
+            commanded minus actual position at every waypoint sent
+        """
+        report = TrajectoryReport()
+        waypoints = iter(waypoints)
+        try:
+            t0, pan, tilt = next(waypoints)
+        except StopIteration:
+            return report
+        if not self.move_to(pan, tilt):
+            return report
+        self.wait_until_ready()
+        # The segments change the speeds, put them back afterwards
+        speeds_before = (self.pan_speed, self.tilt_speed)
+        try:
+            start = time.time() - t0
+            # Segment the head is on: from `a` at `ta` to `b` at `tb`
+            ta = tb = t0
+            a = b = (pan, tilt)
+            speeds = (None, None)
+            for t, pan, tilt in waypoints:
+                if t < tb:
+                    raise ValueError("Waypoint at %s s comes after %s s" % (t, tb))
+                send_at = start + tb - lead
+                now = time.time()
+                if send_at > now:
+                    time.sleep(send_at - now)
+                elif tb > t0 and now - send_at > lead:
+                    report.late += 1
+                status = self.status(max_age=0)
+                if tb > t0:
+                    expected = interpolate(a, b, ta, tb, status.timestamp - start)
+                    report.add(status.timestamp - start, expected, status.position, speeds)
+                    if self.metrics.enabled:
+                        self.metrics.observe("pt_trajectory_lag_seconds", report.samples[-1][3])
+                # Head for the new waypoint from wherever the head will be
+                # when the previous one is due
+                a, ta, b, tb = b, tb, (int(pan), int(tilt)), t
+                speeds = segment_speeds(a, b, tb - ta, self.PSmax, self.TSmax)
+                if not self.move_to(b[0], b[1], *speeds):
+                    break
+            # Let the last segment finish at its own speed
+            self.wait_until_ready()
+        finally:
+            self._restoreSpeeds(*speeds_before)
+        report.duration = tb - t0
+        self.logger.info(str(report))
+        return report
+
+    def _restoreSpeeds(self, pan_speed, tilt_speed):
+        """
+        Set the pan and tilt speeds back to the given values
+        """
+        commands = []
+        if self.pan_speed != pan_speed:
+            commands.append(b"PS"+str(pan_speed).encode())
+        if self.tilt_speed != tilt_speed:
+            commands.append(b"TS"+str(tilt_speed).encode())
+        if not commands:
+            return
+        try:
+            self.execute_many(commands)
+            self.pan_speed, self.tilt_speed = pan_speed, tilt_speed
+        except IOError as ex:
+            self.logger.error("Cannot restore speeds %s: %s" % (str(commands), str(ex)))
+
+    def start_telemetry(self, rate=20, capacity=None):
+        """
+        Start recording the position and speed in the background
+
+        Parameters:
+        -----------
+        rate : float
+            samples per second (default: 20)
+        capacity : int
+            Optional. Samples kept, the oldest are overwritten.
+            Defaults to one hour at `rate`
+
+        Returns:
+        --------
+        recorder : telemetry.TelemetryRecorder
+            holds the samples and exports them
+        """
+        self.stop_telemetry()
+        self.telemetry = TelemetryRecorder(self, rate, capacity).start()
+        return self.telemetry
+
+    def stop_telemetry(self):
+        """
+        Stop the background recording. Its samples stay available
+        in `telemetry` until the next start
+        """
+        if self.telemetry is not None:
+            self.telemetry.stop()
+
     def cleanup(self):
         """
-        Make sure to close the telnet connection and curses window
-        before exiting the program
+        Make sure to close the connection and curses window
+        before exiting the program. Also called at exit for
+        controllers that were not cleaned up
         """
+        atexit.unregister(self.cleanup)
         self.logger.info("Quitting Control ")
-        self._closeTelnet(self.tn)
-        traceback.print_exc()
+        self.stop_telemetry()
+        with self._state_lock:
+            self.state = CLOSED
+            self._connected.set()
+        self._closeConnection(self.conn)
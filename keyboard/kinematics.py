@@ -0,0 +1,142 @@
+# -* coding: utf-8 -*-
+"""
+Motion time model of the pan and tilt.
+
+Each axis follows a trapezoidal speed profile: it accelerates at
+`accel` up to the configured speed, cruises and decelerates back to
+rest. Short hops never reach the configured speed and take a
+triangular profile instead. A fixed `overhead` covers the command
+latency and settling before the module reports ready again.
+
+Both axes move at the same time so a move takes as long as the
+slower axis. The parameters start from the data sheet defaults and
+are refit from observed moves with `observe`.
+
+Usage:
+------
+model = MotionModel()
+seconds = model.estimate((0, 0), (3000, -500), 150, 150)
+...
+model.observe((0, 0), (3000, -500), 150, 150, measured)
+"""
+
+import collections
+import math
+
+
+class AxisModel(object):
+    """
+    Trapezoidal motion time of one axis
+
+    Parameters
+    ----------
+    accel : float, optional
+        positions per second squared. 0 or None for instant
+        acceleration (default: 2000, as set by the module on reset)
+    overhead : float, optional
+        seconds added to every move (default: 0)
+    window : int, optional
+        number of recent moves used for calibration (default: 50)
+    """
+    def __init__(self, accel=2000.0, overhead=0.0, window=50):
+        # Seconds lost per unit of speed on ramping up and down, 1/accel
+        self.ramp = 1.0 / accel if accel else 0.0
+        self.overhead = overhead
+        self.samples = collections.deque(maxlen=window)
+
+    @property
+    def accel(self):
+        return 1.0 / self.ramp if self.ramp else float("inf")
+
+    def duration(self, distance, speed):
+        """
+        Seconds to travel `distance` positions with a top speed of `speed`
+        """
+        distance = abs(distance)
+        if not distance:
+            return 0.0
+        speed = float(speed)
+        if distance >= speed * speed * self.ramp:
+            return distance / speed + speed * self.ramp + self.overhead
+        # Triangular profile, top speed is never reached
+        return 2 * math.sqrt(distance * self.ramp) + self.overhead
+
+    def observe(self, distance, speed, seconds):
+        """
+        Add a measured move and refit `ramp` and `overhead`
+
+        Only moves long enough to reach their top speed are used.
+        Their time beyond `distance / speed` grows linearly with
+        the speed (`speed / accel + overhead`), which is fit by
+        least squares. With a single speed in the window the two
+        cannot be told apart, the acceleration is then only lowered
+        as far as the measurements require
+        """
+        distance = abs(distance)
+        speed = float(speed)
+        if not distance or speed <= 0 or distance < speed * speed * self.ramp:
+            return
+        self.samples.append((speed, seconds - distance / speed))
+        n = len(self.samples)
+        mean_speed = sum(s for s, r in self.samples) / n
+        mean_excess = sum(r for s, r in self.samples) / n
+        var = sum((s - mean_speed) ** 2 for s, r in self.samples)
+        if var > 1e-6 * n * mean_speed * mean_speed:
+            cov = sum((s - mean_speed) * (r - mean_excess) for s, r in self.samples)
+            self.ramp = max(cov / var, 0.0)
+        elif mean_excess < self.ramp * mean_speed:
+            # Faster than the assumed acceleration allows
+            self.ramp = max(mean_excess, 0.0) / mean_speed
+        self.overhead = max(mean_excess - self.ramp * mean_speed, 0.0)
+
+    def __repr__(self):
+        return "AxisModel(accel=%.1f, overhead=%.3f)" % (self.accel, self.overhead)
+
+
+class MotionModel(object):
+    """
+    Move duration of the pan and tilt, the slower axis deciding
+
+    Parameters
+    ----------
+    pan, tilt : AxisModel, optional
+        model of each axis
+    """
+    def __init__(self, pan=None, tilt=None):
+        self.pan = pan or AxisModel()
+        self.tilt = tilt or AxisModel()
+
+    def axis_times(self, start, target, pan_speed, tilt_speed):
+        """
+        Returns (pan seconds, tilt seconds) of a move
+        """
+        return (self.pan.duration(target[0] - start[0], pan_speed),
+                self.tilt.duration(target[1] - start[1], tilt_speed))
+
+    def estimate(self, start, target, pan_speed, tilt_speed):
+        """
+        Seconds to move from `start` to `target`
+
+        Parameters
+        ----------
+        start, target : (pan, tilt)
+            positions, extra items such as zoom are ignored
+        pan_speed, tilt_speed : float
+            configured speed of each axis in positions per second
+        """
+        return max(self.axis_times(start, target, pan_speed, tilt_speed))
+
+    def observe(self, start, target, pan_speed, tilt_speed, seconds):
+        """
+        Calibrate from a measured move. Only the duration of the
+        slower axis is observed, so the move is credited to the axis
+        expected to take longer and skipped when both are close
+        """
+        pan_time, tilt_time = self.axis_times(start, target, pan_speed, tilt_speed)
+        if tilt_time < 0.8 * pan_time:
+            self.pan.observe(target[0] - start[0], pan_speed, seconds)
+        elif pan_time < 0.8 * tilt_time:
+            self.tilt.observe(target[1] - start[1], tilt_speed, seconds)
+
+    def __repr__(self):
+        return "MotionModel(pan=%r, tilt=%r)" % (self.pan, self.tilt)
@@ -0,0 +1,69 @@
+# -* coding: utf-8 -*-
+"""
+Snapshot of the pan and tilt state as reported by the `B` query
+"""
+
+import time
+from pyflirpt.utils.ptprotocol import parse_status
+
+
+class PTStatus(object):
+    """
+    Pan and tilt position and speed parsed once from a `B` reply,
+    e.g. `* P(100,-200) S(0,0)`
+
+    Attributes
+    ----------
+    pan, tilt : int
+        current position
+    pan_speed, tilt_speed : int
+        current speed, both 0 when the module is idle
+    timestamp : float
+        time.time() at which the reply was received
+    """
+    __slots__ = ("pan", "tilt", "pan_speed", "tilt_speed", "timestamp")
+
+    def __init__(self, pan, tilt, pan_speed, tilt_speed, timestamp=None):
+        self.pan = pan
+        self.tilt = tilt
+        self.pan_speed = pan_speed
+        self.tilt_speed = tilt_speed
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    @classmethod
+    def from_reply(cls, output):
+        """
+        Parse the reply of a `B` query
+
+        Parameters
+        ----------
+        output : bytes
+            reply of the `B` command
+
+        Returns
+        -------
+        status : PTStatus
+        """
+        return cls(*parse_status(output))
+
+    @property
+    def position(self):
+        return (self.pan, self.tilt)
+
+    @property
+    def moving(self):
+        return bool(self.pan_speed or self.tilt_speed)
+
+    @property
+    def ready(self):
+        return not self.moving
+
+    def age(self):
+        """
+        Seconds since the snapshot was taken
+        """
+        return time.time() - self.timestamp
+
+    def __repr__(self):
+        return "PTStatus(pan=%d, tilt=%d, pan_speed=%d, tilt_speed=%d)" % (
+            self.pan, self.tilt, self.pan_speed, self.tilt_speed)
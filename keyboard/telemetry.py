@@ -0,0 +1,216 @@
+# -* coding: utf-8 -*-
+"""
+Background recording of the pan and tilt position and speed, for
+later correlation with imagery.
+
+Samples go to a ring buffer of `array` columns allocated once, so
+a recording of any length takes constant memory: once full, the
+oldest samples are overwritten. `export` writes the buffer as a
+columnar binary file:
+
+    header  : b"PTTM", format version and sample count, as
+              little endian "<4sII"
+    columns : time (float64), pan, tilt, pan speed, tilt speed
+              (int32), one after the other, oldest sample first
+
+which `read_columns` loads back, or numpy can memory map directly,
+e.g. `numpy.memmap(path, "<f8", "r", offset=12, shape=(count,))`
+for the timestamps.
+
+Usage:
+------
+recorder = kctrl.start_telemetry(rate=20)
+...
+recorder.export("telemetry.bin")
+kctrl.stop_telemetry()
+"""
+
+import array
+import csv
+import struct
+import sys
+import threading
+import time
+from pyflirpt.utils import ptlogger
+
+MAGIC = b"PTTM"
+VERSION = 1
+_HEADER = struct.Struct("<4sII")
+# (name, array typecode) of every column, in file order
+COLUMNS = (("time", "d"), ("pan", "i"), ("tilt", "i"),
+           ("pan_speed", "i"), ("tilt_speed", "i"))
+
+
+class RingBuffer(object):
+    """
+    Fixed size buffer of samples, one preallocated array per column
+
+    Parameters
+    ----------
+    capacity : int
+        number of samples kept, the oldest are overwritten
+    """
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("Capacity must be positive: "+str(capacity))
+        self.capacity = capacity
+        self.columns = [array.array(code, [0]) * capacity for name, code in COLUMNS]
+        self.written = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def append(self, *values):
+        """
+        Store one sample: time, pan, tilt, pan speed, tilt speed
+        """
+        with self._lock:
+            index = self.written % self.capacity
+            for column, value in zip(self.columns, values):
+                column[index] = value
+            self.written += 1
+
+    def snapshot(self):
+        """
+        Returns a copy of every column, oldest sample first
+        """
+        with self._lock:
+            if self.written <= self.capacity:
+                return [column[:self.written] for column in self.columns]
+            index = self.written % self.capacity
+            return [column[index:] + column[:index] for column in self.columns]
+
+    def last(self):
+        """
+        Returns the latest sample as a tuple, None if empty
+        """
+        with self._lock:
+            if not self.written:
+                return None
+            index = (self.written - 1) % self.capacity
+            return tuple(column[index] for column in self.columns)
+
+
+def read_columns(path):
+    """
+    Load a file written by `TelemetryRecorder.export`
+
+    Returns
+    -------
+    columns : dict
+        column name to `array`
+    """
+    with open(path, "rb") as t_handler:
+        magic, version, count = _HEADER.unpack(t_handler.read(_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a telemetry file" % path)
+        columns = {}
+        for name, code in COLUMNS:
+            column = array.array(code)
+            column.fromfile(t_handler, count)
+            if sys.byteorder != "little":
+                column.byteswap()
+            columns[name] = column
+    return columns
+
+
+class TelemetryRecorder(object):
+    """
+    Samples the status of a `KeyboardController` at a fixed rate
+    on a background thread
+
+    A status queried by the controller itself less than half a
+    period ago is reused instead of asking the module again, and
+    a query in progress only holds the connection for one round
+    trip, so control commands are never delayed by more than that.
+    Ticks that cannot be served in time (e.g. while reconnecting)
+    are skipped and counted in `missed`
+
+    Parameters
+    ----------
+    controller : KeyboardController
+    rate : float, optional
+        samples per second (default: 20)
+    capacity : int, optional
+        samples kept (default: one hour at `rate`)
+    """
+    def __init__(self, controller, rate=20, capacity=None):
+        self.logger = ptlogger.ptlogger(tofile=True)
+        self.controller = controller
+        self.period = 1.0 / rate
+        self.buffer = RingBuffer(capacity or int(3600 * rate))
+        self.missed = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="TelemetryRecorder")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        tick = time.time()
+        last = None
+        while not self._stop.wait(max(tick - time.time(), 0)):
+            try:
+                status = self.controller.status(max_age=self.period / 2, cache=False)
+            except Exception as ex:
+                self.errors += 1
+                self.logger.debug("Telemetry sample failed: "+str(ex))
+            else:
+                if status.timestamp != last:
+                    self.buffer.append(status.timestamp, status.pan, status.tilt,
+                                       status.pan_speed, status.tilt_speed)
+                    last = status.timestamp
+            tick += self.period
+            behind = time.time() - tick
+            if behind > 0:
+                skipped = int(behind / self.period) + 1
+                self.missed += skipped
+                tick += skipped * self.period
+
+    def export(self, path):
+        """
+        Write the buffered samples as a columnar binary file (see
+        the module documentation for the layout)
+
+        Returns
+        -------
+        count : int
+            number of samples written
+        """
+        columns = self.buffer.snapshot()
+        with open(path, "wb") as t_handler:
+            t_handler.write(_HEADER.pack(MAGIC, VERSION, len(columns[0])))
+            for column in columns:
+                if sys.byteorder != "little":
+                    column.byteswap()
+                column.tofile(t_handler)
+        return len(columns[0])
+
+    def export_csv(self, path):
+        """
+        Write the buffered samples as CSV, one row per sample
+
+        Returns
+        -------
+        count : int
+            number of samples written
+        """
+        columns = self.buffer.snapshot()
+        with open(path, "w") as t_handler:
+            writer = csv.writer(t_handler)
+            writer.writerow([name for name, code in COLUMNS])
+            for row in zip(*columns):
+                writer.writerow(("%.4f" % row[0],) + row[1:])
+        return len(columns[0])
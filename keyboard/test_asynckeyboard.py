@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from pyflirpt.keyboard.asynckeyboard import AsyncKeyboardController
+from pyflirpt.utils.ptbackoff import BackoffPolicy
+
+
+class RecordingBackoff(BackoffPolicy):
+    def __init__(self):
+        BackoffPolicy.__init__(self, base=0.01)
+        self.attempts = []
+
+    def delay(self, attempt):
+        self.attempts.append(attempt)
+        return 0
+
+
+def _cutReplies(controller):
+    # Replies from now on look like a closed connection
+    reader = asyncio.StreamReader()
+    reader.feed_eof()
+    controller.reader = reader
+
+
+def test_reset_uses_configured_speeds(simulator):
+    async def main():
+        controller = AsyncKeyboardController(simulator.host, simulator.port, keepalive=0)
+        controller.pan_speed, controller.tilt_speed = 300, 400
+        async with controller:
+            return (simulator.pan_speed, simulator.tilt_speed)
+    assert asyncio.run(main()) == (300, 400)
+
+
+def test_idempotent_command_resent_with_backoff(simulator):
+    async def main():
+        backoff = RecordingBackoff()
+        async with AsyncKeyboardController(simulator.host, simulator.port, keepalive=0,
+                                           backoff=backoff) as controller:
+            _cutReplies(controller)
+            status = await controller.status()
+        return backoff.attempts, status
+    attempts, status = asyncio.run(main())
+    assert attempts == [0]
+    assert status.position == (0, 0)
+
+
+def test_non_idempotent_command_not_resent(simulator):
+    async def main():
+        backoff = RecordingBackoff()
+        async with AsyncKeyboardController(simulator.host, simulator.port, keepalive=0,
+                                           backoff=backoff) as controller:
+            _cutReplies(controller)
+            try:
+                await controller.execute(b"PO10")
+            except IOError:
+                pass
+            else:
+                raise AssertionError("PO10 failure not raised")
+            closed = controller.writer is None
+        return backoff.attempts, closed
+    attempts, closed = asyncio.run(main())
+    # No reconnect means no second PO10
+    assert attempts == []
+    assert closed
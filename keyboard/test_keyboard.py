@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import socket
+import time
+
+import pytest
+
+from pyflirpt.keyboard.keyboard import KeyboardController
+from pyflirpt.utils.ptbackoff import BackoffPolicy
+from pyflirpt.utils.ptsimulator import PTSimulator
+
+
+@pytest.fixture
+def controller(simulator):
+    kctrl = KeyboardController(simulator.host, simulator.port, timeout=2)
+    yield kctrl
+    kctrl.cleanup()
+
+
+def test_batch_sends_commands_on_exit(controller, simulator):
+    with controller.batch() as batch:
+        controller.pan(120)
+        controller.tilt(60)
+    assert batch.commands == [b"PP120", b"TP60"]
+    assert batch.replies == [b"*\r\n", b"*\r\n"]
+    assert controller.wait_until_ready()[0]
+    assert (simulator.pan, simulator.tilt) == (120, 60)
+
+
+def test_nested_batch_rejected(controller):
+    with controller.batch() as outer:
+        with pytest.raises(RuntimeError):
+            with controller.batch():
+                pass
+        controller.pan(100)
+    assert outer.commands == [b"PP100"]
+
+
+def test_status_refused_inside_batch(controller):
+    with controller.batch():
+        with pytest.raises(RuntimeError):
+            controller.status(max_age=0)
+
+
+class RecordingBackoff(BackoffPolicy):
+    def __init__(self):
+        BackoffPolicy.__init__(self)
+        self.attempts = []
+
+    def delay(self, attempt):
+        self.attempts.append(attempt)
+        return 0.01
+
+
+def test_idempotent_command_resent_after_drop(controller, simulator):
+    conn = controller.conn
+    conn.sock.shutdown(socket.SHUT_RDWR)
+    assert controller.status(max_age=0).position == (0, 0)
+    assert controller.conn is not conn
+
+
+def test_reconnect_backs_off_until_reachable(simulator):
+    backoff = RecordingBackoff()
+    kctrl = KeyboardController(simulator.host, simulator.port, timeout=2,
+                               reconnect_timeout=5, backoff=backoff)
+    try:
+        simulator.stop()
+        kctrl._resetConnection(wait=False)
+        deadline = time.time() + 2
+        while len(backoff.attempts) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        assert backoff.attempts[:3] == [0, 1, 2]
+        restarted = PTSimulator(port=simulator.port)
+        restarted.start()
+        try:
+            assert kctrl.status(max_age=0).position == (0, 0)
+        finally:
+            restarted.stop()
+    finally:
+        kctrl.cleanup()
+
+
+def test_connection_reset_under_caller_raises_ioerror(controller, monkeypatch):
+    conn = controller.conn
+    monkeypatch.setattr(controller, "_awaitConnection", lambda: None)
+    # As if another thread reset the connection right after the check
+    controller.conn = None
+    with pytest.raises(IOError):
+        controller.execute(b"PO10")
+    conn.close()
+
+
+def test_unexpected_errors_are_not_swallowed(controller, monkeypatch):
+    def broken(*args):
+        raise ValueError("broken")
+    monkeypatch.setattr(controller, "_exchangeReplies", broken)
+    with pytest.raises(ValueError):
+        controller.execute(b"B")
+    with pytest.raises(ValueError):
+        controller.execute_many([b"B", b"B"])
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import time
+
+from pyflirpt.keyboard.keyboard import KeyboardController
+from pyflirpt.keyboard.telemetry import RingBuffer, read_columns
+
+
+def test_ring_buffer_wraps_oldest_first():
+    ring = RingBuffer(3)
+    for i in range(5):
+        ring.append(float(i), i, -i, 0, 0)
+    assert len(ring) == 3
+    assert list(ring.snapshot()[0]) == [2.0, 3.0, 4.0]
+    assert ring.last() == (4.0, 4, -4, 0, 0)
+
+
+def test_recording_wraps_and_exports(simulator, tmp_path):
+    kctrl = KeyboardController(simulator.host, simulator.port, timeout=2)
+    try:
+        recorder = kctrl.start_telemetry(rate=100, capacity=5)
+        deadline = time.time() + 5
+        while recorder.buffer.written <= 5 and time.time() < deadline:
+            time.sleep(0.01)
+        kctrl.stop_telemetry()
+        path = str(tmp_path / "telemetry.bin")
+        assert recorder.export(path) == 5
+    finally:
+        kctrl.cleanup()
+    columns = read_columns(path)
+    times = list(columns["time"])
+    assert len(times) == 5
+    assert times == sorted(times)
+    assert times[-1] == recorder.buffer.last()[0]
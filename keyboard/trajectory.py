@@ -0,0 +1,125 @@
+# -* coding: utf-8 -*-
+"""
+Helpers for streaming timestamped (pan, tilt) waypoints to the pan
+and tilt with `KeyboardController.follow_trajectory`.
+
+Each waypoint is sent shortly before the previous one is reached,
+with the speeds that bring both axes to it on time, so the head
+never stops in between. The lag between where the head should be
+and where it is gets sampled as it goes.
+
+Usage:
+------
+report = kctrl.follow_trajectory(sweep(-3000, 3000, tilt=0, duration=60))
+print(report)
+"""
+
+import math
+
+
+def sweep(pan_from, pan_to, tilt, duration, step=1.0):
+    """
+    Waypoints of a constant speed pan between two positions
+
+    Parameters
+    ----------
+    pan_from, pan_to : int
+        pan positions at the start and the end
+    tilt : int
+        tilt position held during the sweep
+    duration : float
+        seconds the sweep takes
+    step : float, optional
+        seconds between waypoints (default: 1)
+
+    Yields
+    ------
+    (t, pan, tilt) : tuple
+        seconds from the start and target position
+    """
+    count = max(1, int(math.ceil(duration / float(step))))
+    for i in range(count + 1):
+        t = min(i * step, duration)
+        yield (t, int(round(pan_from + (pan_to - pan_from) * t / float(duration))), tilt)
+
+
+def segment_speeds(a, b, seconds, max_pan_speed, max_tilt_speed, min_speed=1):
+    """
+    Speeds taking each axis from waypoint `a` to `b` in `seconds`,
+    clamped to the allowed range
+
+    Returns
+    -------
+    (pan_speed, tilt_speed) : tuple
+        None for an axis that does not move
+    """
+    speeds = []
+    for distance, max_speed in ((b[0] - a[0], max_pan_speed), (b[1] - a[1], max_tilt_speed)):
+        if not distance:
+            speeds.append(None)
+        elif seconds <= 0:
+            speeds.append(max_speed)
+        else:
+            speeds.append(int(min(max(round(abs(distance) / seconds), min_speed), max_speed)))
+    return tuple(speeds)
+
+
+def interpolate(a, b, ta, tb, t):
+    """
+    Position between waypoints `a` (at `ta`) and `b` (at `tb`) at time `t`
+    """
+    if tb <= ta or t >= tb:
+        return (b[0], b[1])
+    if t <= ta:
+        return (a[0], a[1])
+    f = (t - ta) / float(tb - ta)
+    return (a[0] + (b[0] - a[0]) * f, a[1] + (b[1] - a[1]) * f)
+
+
+class TrajectoryReport(object):
+    """
+    Lag between the commanded trajectory and the reported position
+
+    Attributes
+    ----------
+    samples : list of (t, pan error, tilt error, seconds behind)
+        one per waypoint sent, errors are commanded minus actual
+        positions and `seconds behind` the largest error divided
+        by the speed of its axis
+    late : int
+        waypoints sent after their scheduled time
+    duration : float
+        seconds from the first to the last waypoint
+    """
+    def __init__(self):
+        self.samples = []
+        self.late = 0
+        self.duration = 0.0
+
+    def add(self, t, expected, actual, speeds):
+        errors = (expected[0] - actual[0], expected[1] - actual[1])
+        behind = 0.0
+        for error, speed in zip(errors, speeds):
+            if speed:
+                behind = max(behind, abs(error) / float(speed))
+        self.samples.append((t, errors[0], errors[1], behind))
+
+    def max_error(self):
+        """
+        Largest (pan, tilt) error in positions
+        """
+        if not self.samples:
+            return (0, 0)
+        return (max(abs(s[1]) for s in self.samples), max(abs(s[2]) for s in self.samples))
+
+    def mean_lag(self):
+        """
+        Mean seconds behind the commanded trajectory
+        """
+        if not self.samples:
+            return 0.0
+        return sum(s[3] for s in self.samples) / len(self.samples)
+
+    def __repr__(self):
+        return "TrajectoryReport(waypoints=%d, duration=%.2f, max_error=%s, mean_lag=%.3f, late=%d)" % (
+            len(self.samples), self.duration, self.max_error(), self.mean_lag(), self.late)
@@ -0,0 +1,109 @@
+"""
+Latency and throughput benchmark for the pan and tilt command paths.
+
+Reports commands/sec and p50/p99 round trip latency for the pooled
+connection (`JoystickControl._commandToPT`), `KeyboardController.execute`
+and `execute_many`, plus the time of one scan cycle over a plan
+(`UOIR.runTask`).
+
+Runs against a local simulator unless --host is passed:
+
+    python -m pyflirpt.samples.benchmark --latency 0.002 --jitter 0.001
+"""
+from pyflirpt.utils import ptconnection, ptsimulator, ptmetrics
+from pyflirpt.keyboard import keyboard
+from pyflirpt.scan import plan
+import argparse
+import os
+import time
+
+PLAN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "movement.conf")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def report(name, latencies, commands):
+    total = sum(latencies)
+    print("%-22s %9.0f cmd/s   p50 %8.1f us   p99 %8.1f us" % (
+        name, commands / total,
+        percentile(latencies, 50) * 1e6, percentile(latencies, 99) * 1e6))
+
+
+def timed(func, rounds):
+    latencies = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def scan_cycle(kctrl, positions):
+    """
+    Visit every position once like `UOIR.runTask`
+
+    Returns
+    -------
+    (seconds, polls) : tuple
+    """
+    polls = 0
+    start = time.perf_counter()
+    for pan, tilt, zoom in positions:
+        kctrl.move_to(pan, tilt)
+        ready, used = kctrl.wait_until_ready(timeout=120)
+        polls += used
+    return time.perf_counter() - start, polls
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", help="benchmark real hardware instead of the simulator")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=5, help="commands per pipelined batch")
+    parser.add_argument("--latency", type=float, default=0, help="simulated seconds per reply packet")
+    parser.add_argument("--jitter", type=float, default=0, help="simulated max extra seconds per packet")
+    parser.add_argument("--speed", type=int, default=150, help="PS/TS speed for the scan cycle")
+    parser.add_argument("--plan", default=PLAN_FILE, help="scan plan for the cycle benchmark")
+    parser.add_argument("--no-scan", action="store_true", help="skip the scan cycle benchmark")
+    parser.add_argument("--metrics", choices=("prometheus", "json"),
+                        help="record metrics and print them at the end")
+    args = parser.parse_args()
+    if args.metrics:
+        ptmetrics.registry.enable()
+
+    sim = None
+    if args.host:
+        address = (args.host, args.port)
+    else:
+        sim = ptsimulator.PTSimulator(latency=args.latency, jitter=args.jitter)
+        address = sim.start()
+
+    conn = ptconnection.get_connection(*address)
+    report("pooled connection", timed(lambda: conn.execute(b"B"), args.rounds), args.rounds)
+
+    kctrl = keyboard.KeyboardController(*address)
+    report("execute", timed(lambda: kctrl.execute(b"B"), args.rounds), args.rounds)
+    batches = max(1, args.rounds // args.batch)
+    report("execute_many (x%d)" % args.batch,
+           timed(lambda: kctrl.execute_many([b"B"] * args.batch), batches),
+           batches * args.batch)
+
+    if not args.no_scan:
+        positions = plan.load(args.plan, cache=False)
+        kctrl.pan_speed = kctrl.tilt_speed = args.speed
+        kctrl.resetPT()
+        seconds, polls = scan_cycle(kctrl, positions)
+        print("scan cycle             %d positions in %.2f s at speed %d, %d polls" % (
+            len(positions), seconds, args.speed, polls))
+
+    if args.metrics == "prometheus":
+        print(ptmetrics.registry.to_prometheus())
+    elif args.metrics == "json":
+        print(ptmetrics.registry.to_json(indent=2))
+
+    if sim:
+        sim.stop()
@@ -1,16 +1,21 @@
 from pyflirpt.utils import ptlogger
 from pyflirpt.keyboard import keyboard
+from pyflirpt.scan import plan, executor, actions, scheduler
 import os
 import sys
-import time
-from itertools import cycle
 
 CONFIG_FILE = "movement.conf"
+# Optional per target revisit, dwell and priority, see scan.scheduler.
+# Without it every position in CONFIG_FILE is visited as often as possible
+SCHEDULE_FILE = "schedule.conf"
+METADATA_FILE = "scan_metadata.csv"
 
 class UOIR(object):
 
     def __init__(self):
         self.logger = ptlogger.ptlogger(tofile=True)
+        # Keep the controller's debug logging off the command path
+        ptlogger.ptlogger("keyboard", tofile=True, asynchronous=True)
         self.keycontrol = self.getKeyObj()
         
     def getKeyObj(self):
@@ -24,49 +29,38 @@ class UOIR(object):
             sys.exit(1)
             
     def initialize(self):
-        positions = []
-        with open(CONFIG_FILE, 'r') as c_handler:
-            positions = c_handler.readlines()
-            self.logger.info("Total positions: " + str(len(positions) + 1))
-        return positions
+        try:
+            targets = scheduler.load_targets(
+                SCHEDULE_FILE if os.path.exists(SCHEDULE_FILE) else CONFIG_FILE)
+        except plan.PlanError as ex:
+            self.logger.critical("Bad scan plan: "+str(ex))
+            sys.exit(1)
+        self.logger.info("Total positions: " + str(len(targets)))
+        # Zoom and capture hooks go here, e.g.
+        # self.actions.add(actions.Zoom(camera.set_zoom), actions.MOVE)
+        # self.actions.add(actions.Capture(camera.trigger), actions.ARRIVE)
+        self.actions = actions.ActionPipeline()
+        self.actions.add(actions.MetadataWriter(METADATA_FILE), actions.AFTER)
+        # Per move speeds, both axes arriving together
+        self.executor = executor.ScanExecutor(self.keycontrol, [], adaptive=True,
+                                              actions=self.actions)
+        # Earliest deadline first, charging every move its predicted slew
+        self.scheduler = scheduler.Scheduler(targets, self.executor.max_pan_speed,
+                                             self.executor.max_tilt_speed,
+                                             model=self.keycontrol.motion)
+        return targets
 
-    def runTask(self, pos_cycle):
+    def runTask(self):
         while True:
             try:
-                print("Here")
-                # Create an iterator cycle for the positions
-                position = pos_cycle.next()
-                self.logger.info("Moving to position: " + str(position))
-                self.pan_pos = position.split('_')[0]
-                self.tilt_pos = position.split('_')[1].split(',')[0]
-            
-                # ---- Hacky way to remove p and n from pan and tilt
-                # and replace them with + / - signs
-                if "p" in self.pan_pos:
-                    self.pan_pos = self.pan_pos.strip("p")
-                elif "n" in self.pan_pos:
-                    self.pan_pos = "-"+self.pan_pos.strip("n")
-                if "p" in self.tilt_pos:
-                    self.tilt_pos = self.tilt_pos.strip("p")
-                elif "n" in self.tilt_pos:
-                    self.tilt_pos = "-"+self.tilt_pos.strip("n")
-                # ----
-        
-                self.zoom_fac = position.split(',')[1]
-                self.keycontrol.pan(self.pan_pos)
-                self.keycontrol.tilt(self.tilt_pos)
-                
-                while not self.keycontrol.ready():
-                    self.logger.info("Waiting for PT module ")
-            
+                # Report the revisit rates after every round of visits
+                self.scheduler.run(self.executor, visits=len(self.scheduler.targets))
+                self.logger.info("Revisit intervals:\n" + self.scheduler.format_report())
             except Exception as ex:
                 self.logger.critical("RunTask exception: "+str(ex))
                 sys.exit(1)
-                
-        time.sleep(1)
 
 if __name__ == "__main__":
     uoir = UOIR()
-    positions = uoir.initialize()
-    position_cycle = cycle(positions)
-    uoir.runTask(position_cycle)
+    uoir.initialize()
+    uoir.runTask()
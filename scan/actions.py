@@ -0,0 +1,198 @@
+# -* coding: utf-8 -*-
+"""
+Per position actions of a scan: zoom, capture, metadata, or any
+callable taking a `Position`.
+
+Every action runs at one of three stages of a position:
+
+- MOVE: as soon as the move towards the position is sent, in the
+  background while the pan and tilt slews (e.g. setting the zoom).
+  Finished before the ARRIVE actions start
+- ARRIVE: as soon as `ready()` flips, in order. The next move waits
+  for them (e.g. triggering a capture). Skipped if the position was
+  not reached
+- AFTER: in the background once the ARRIVE actions are done, while
+  the next move is already under way (e.g. writing metadata)
+
+Usage:
+------
+pipeline = ActionPipeline()
+pipeline.add(Zoom(camera.set_zoom), MOVE)
+pipeline.add(Capture(camera.trigger), ARRIVE)
+pipeline.add(MetadataWriter("scan.csv"), AFTER)
+executor = ScanExecutor(kctrl, plan, actions=pipeline)
+"""
+
+import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pyflirpt.utils import ptlogger, ptmetrics
+
+# Stages
+MOVE = "move"
+ARRIVE = "arrive"
+AFTER = "after"
+
+
+class Position(object):
+    """
+    One visit of a scan position, handed to every action
+
+    Attributes
+    ----------
+    index : int
+        index of the position in the plan
+    pan, tilt, zoom : int
+        target
+    sent, arrived : float
+        time.time() at which the move was sent and the module
+        reported ready (None until then)
+    ready : bool
+        whether the module reached the position
+    metadata : dict
+        free for actions to fill in, e.g. the capture file name
+    """
+    __slots__ = ("index", "pan", "tilt", "zoom", "sent", "arrived", "ready", "metadata")
+
+    def __init__(self, index, pan, tilt, zoom):
+        self.index = index
+        self.pan = pan
+        self.tilt = tilt
+        self.zoom = zoom
+        self.sent = None
+        self.arrived = None
+        self.ready = False
+        self.metadata = {}
+
+    def __repr__(self):
+        return "Position(index=%d, pan=%d, tilt=%d, zoom=%d)" % (
+            self.index, self.pan, self.tilt, self.zoom)
+
+
+class Zoom(object):
+    """
+    Set the zoom of the position, skipping unchanged values
+
+    Parameters
+    ----------
+    set_zoom : callable
+        `set_zoom(zoom)`, e.g. the camera's zoom control
+    """
+    def __init__(self, set_zoom):
+        self.set_zoom = set_zoom
+        self.zoom = None
+
+    def __call__(self, position):
+        if position.zoom != self.zoom:
+            self.set_zoom(position.zoom)
+            self.zoom = position.zoom
+
+
+class Capture(object):
+    """
+    Trigger a capture. Whatever `trigger` returns (e.g. a file
+    name) is kept in `position.metadata['capture']`
+
+    Parameters
+    ----------
+    trigger : callable
+        `trigger(position)`
+    """
+    def __init__(self, trigger):
+        self.trigger = trigger
+
+    def __call__(self, position):
+        position.metadata["capture"] = self.trigger(position)
+        position.metadata["captured"] = time.time()
+
+
+class MetadataWriter(object):
+    """
+    Append one CSV row per visited position: index, pan, tilt,
+    zoom, sent, arrived, ready and the sorted metadata items
+
+    Parameters
+    ----------
+    path : str
+        CSV file, appended to
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, position):
+        row = [position.index, position.pan, position.tilt, position.zoom,
+               "%.3f" % position.sent, "%.3f" % (position.arrived or 0), int(position.ready)]
+        row += ["%s=%s" % item for item in sorted(position.metadata.items())]
+        with open(self.path, "a") as m_handler:
+            csv.writer(m_handler).writerow(row)
+
+
+class ActionPipeline(object):
+    """
+    Runs the actions of every position at their stage
+
+    Parameters
+    ----------
+    metrics : ptmetrics.Registry, optional
+        where to record the duration of every action
+    """
+    def __init__(self, metrics=None):
+        self.logger = ptlogger.ptlogger(tofile=True)
+        self.metrics = metrics if metrics is not None else ptmetrics.registry
+        self.actions = {MOVE: [], ARRIVE: [], AFTER: []}
+        self.errors = 0
+        # One worker per background stage keeps each stage in order
+        self._move_worker = ThreadPoolExecutor(max_workers=1)
+        self._after_worker = ThreadPoolExecutor(max_workers=1)
+        self._moving = None
+
+    def add(self, action, stage=ARRIVE):
+        """
+        Run `action(position)` at `stage` of every position
+        """
+        if stage not in self.actions:
+            raise ValueError("Unknown stage: "+str(stage))
+        self.actions[stage].append(action)
+        return action
+
+    def _run(self, stage, position):
+        for action in self.actions[stage]:
+            start = time.time()
+            try:
+                action(position)
+            except Exception as ex:
+                self.errors += 1
+                self.logger.error("%s action %r failed at %r: %s" % (
+                    stage, action, position, str(ex)))
+            if self.metrics.enabled:
+                self.metrics.observe("pt_action_seconds", time.time() - start,
+                                     stage=stage, action=type(action).__name__)
+
+    def moving(self, position):
+        """
+        The move towards `position` has been sent: start its MOVE actions
+        """
+        position.sent = time.time()
+        if self.actions[MOVE]:
+            self._moving = self._move_worker.submit(self._run, MOVE, position)
+
+    def arrived(self, position):
+        """
+        The module reported ready at `position`: wait for its MOVE
+        actions, run the ARRIVE actions and queue the AFTER actions
+        """
+        position.arrived = time.time()
+        if self._moving is not None:
+            self._moving.result()
+            self._moving = None
+        if position.ready:
+            self._run(ARRIVE, position)
+        if self.actions[AFTER]:
+            self._after_worker.submit(self._run, AFTER, position)
+
+    def close(self):
+        """
+        Wait for the background actions and stop the workers
+        """
+        self._move_worker.shutdown(wait=True)
+        self._after_worker.shutdown(wait=True)
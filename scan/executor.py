@@ -0,0 +1,224 @@
+# -* coding: utf-8 -*-
+"""
+Scan execution with per move speed selection.
+
+`resetPT` leaves both axes at one fixed speed for the whole scan, so
+short hops crawl and the axis with less to travel arrives early. In
+adaptive mode every move runs its longer axis at the maximum speed and
+slows the other one down just enough for both to arrive together.
+Move times come from the controller's calibrated `MotionModel`.
+
+Per position actions (zoom, capture, metadata) are run by an optional
+`scan.actions.ActionPipeline`.
+
+Usage:
+------
+python -m pyflirpt.scan.executor movement.conf --host 192.168.1.50
+"""
+
+import argparse
+import time
+from pyflirpt.utils import ptlogger
+from pyflirpt.scan.plan import load
+from pyflirpt.scan.actions import Position
+
+# Slowest speed ever selected, in positions per second
+MIN_SPEED = 10
+
+
+def _slowest(axis, distance, seconds, min_speed, max_speed):
+    """
+    Lowest speed at which `axis` covers `distance` within `seconds`.
+    Move time never grows with the speed, so bisect
+    """
+    low, high = min_speed, max_speed
+    if axis.duration(distance, low) <= seconds:
+        return low
+    while high - low > 1:
+        mid = (low + high) // 2
+        if axis.duration(distance, mid) <= seconds:
+            high = mid
+        else:
+            low = mid
+    return high
+
+
+def choose_speeds(start, target, max_pan_speed, max_tilt_speed, model, min_speed=MIN_SPEED):
+    """
+    Pick pan and tilt speeds for a move so that the longer axis runs
+    at full speed and both arrive at the same time
+
+    Parameters
+    ----------
+    start, target : (pan, tilt)
+        positions, extra items such as zoom are ignored
+    max_pan_speed, max_tilt_speed : int
+        fastest allowed speed of each axis
+    model : MotionModel
+        move time of each axis
+    min_speed : int, optional
+        slowest speed to select (default: MIN_SPEED)
+
+    Returns
+    -------
+    (pan_speed, tilt_speed) : tuple
+        None for an axis that does not move
+    """
+    pan_distance = target[0] - start[0]
+    tilt_distance = target[1] - start[1]
+    pan_time = model.pan.duration(pan_distance, max_pan_speed)
+    tilt_time = model.tilt.duration(tilt_distance, max_tilt_speed)
+    pan_speed = tilt_speed = None
+    if pan_distance:
+        pan_speed = max_pan_speed
+        if pan_time < tilt_time:
+            pan_speed = _slowest(model.pan, pan_distance, tilt_time, min_speed, max_pan_speed)
+    if tilt_distance:
+        tilt_speed = max_tilt_speed
+        if tilt_time < pan_time:
+            tilt_speed = _slowest(model.tilt, tilt_distance, pan_time, min_speed, max_tilt_speed)
+    return pan_speed, tilt_speed
+
+
+class ScanExecutor(object):
+    """
+    Visits scan positions with a KeyboardController
+
+    Parameters
+    ----------
+    controller : KeyboardController
+    positions : iterable of (pan, tilt, zoom)
+    adaptive : bool, optional
+        select speeds per move, otherwise move at the controller's
+        configured speed (default: True)
+    max_pan_speed, max_tilt_speed : int, optional
+        speed caps in adaptive mode (default: `PSmax`, `TSmax`)
+    actions : ActionPipeline, optional
+        actions to run at every position
+    """
+    def __init__(self, controller, positions, adaptive=True,
+                 max_pan_speed=None, max_tilt_speed=None, actions=None):
+        self.logger = ptlogger.ptlogger(tofile=True)
+        self.controller = controller
+        self.positions = list(positions)
+        self.adaptive = adaptive
+        self.max_pan_speed = max_pan_speed or controller.PSmax
+        self.max_tilt_speed = max_tilt_speed or controller.TSmax
+        # Speeds the controller was configured with, used in fixed mode
+        self.base_speeds = (controller.pan_speed, controller.tilt_speed)
+        self.actions = actions
+        # Last position reached
+        self.position = None
+
+    def step(self, target, index=0):
+        """
+        Move to `target` and wait for the module to get there
+
+        Parameters
+        ----------
+        target : (pan, tilt) or (pan, tilt, zoom)
+        index : int, optional
+            index of the target in the plan, passed to the actions
+
+        Returns
+        -------
+        (ready, polls) : tuple
+            as returned by `wait_until_ready`
+        """
+        controller = self.controller
+        if self.adaptive:
+            if self.position is None:
+                self.position = controller.current_pos(max_age=0)
+            pan_speed, tilt_speed = choose_speeds(
+                self.position, target, self.max_pan_speed, self.max_tilt_speed,
+                controller.motion)
+        else:
+            pan_speed, tilt_speed = self.base_speeds
+        # Only send the speeds that change
+        if pan_speed == controller.pan_speed:
+            pan_speed = None
+        if tilt_speed == controller.tilt_speed:
+            tilt_speed = None
+        controller.move_to(target[0], target[1], pan_speed, tilt_speed)
+        position = None
+        if self.actions is not None:
+            position = Position(index, target[0], target[1],
+                                target[2] if len(target) > 2 else 0)
+            self.actions.moving(position)
+        ready, polls = controller.wait_until_ready()
+        self.position = (target[0], target[1]) if ready else None
+        if position is not None:
+            position.ready = ready
+            self.actions.arrived(position)
+        return ready, polls
+
+    def run_cycle(self):
+        """
+        Visit every position once
+
+        Returns
+        -------
+        (seconds, polls) : tuple
+            duration of the cycle and the status queries it took
+        """
+        polls = 0
+        start = time.time()
+        for index, target in enumerate(self.positions):
+            ready, used = self.step(target, index)
+            polls += used
+            if not ready:
+                self.logger.warning("Position %s not reached" % str(target))
+        return time.time() - start, polls
+
+
+def compare(controller, positions, cycles=1):
+    """
+    Time scan cycles at the controller's configured speed and then
+    with adaptive speeds
+
+    Returns
+    -------
+    (fixed, adaptive) : tuple
+        mean seconds per cycle in each mode
+    """
+    results = []
+    for adaptive in (False, True):
+        executor = ScanExecutor(controller, positions, adaptive=adaptive)
+        # Start every run from the first position
+        executor.step(executor.positions[0])
+        total = sum(executor.run_cycle()[0] for i in range(cycles))
+        results.append(total / cycles)
+    return tuple(results)
+
+
+def main():
+    from pyflirpt.keyboard.keyboard import KeyboardController
+    from pyflirpt.utils import ptsimulator
+    parser = argparse.ArgumentParser(description="Compare fixed and adaptive speed scan cycles")
+    parser.add_argument("config", help="movement.conf style file")
+    parser.add_argument("--host", help="use real hardware instead of the simulator")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--latency", type=float, default=0, help="simulated seconds per reply packet")
+    parser.add_argument("--cycles", type=int, default=1)
+    args = parser.parse_args()
+
+    sim = None
+    if args.host:
+        address = (args.host, args.port)
+    else:
+        sim = ptsimulator.PTSimulator(latency=args.latency)
+        address = sim.start()
+    positions = load(args.config)
+    controller = KeyboardController(*address)
+    speeds = (controller.pan_speed, controller.tilt_speed)
+    fixed, adaptive = compare(controller, positions, args.cycles)
+    print("Positions               : %d" % len(positions))
+    print("Cycle time fixed speed  : %.2f s (PS%d TS%d)" % ((fixed,) + speeds))
+    print("Cycle time adaptive     : %.2f s (max PS%d TS%d)" % (adaptive, controller.PSmax, controller.TSmax))
+    controller.cleanup()
+    if sim:
+        sim.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# -* coding: utf-8 -*-
+"""
+Fleet of pan and tilt heads, each running its own scan plan.
+
+Every head is driven by its own worker thread so a slow or
+unreachable head never holds up the others. Heads that fail are
+reconnected following a shared `BackoffPolicy`.
+
+Usage:
+------
+fleet = FleetController()
+fleet.add_head("north", "192.168.1.50", 4000, plan.load("north.conf"))
+fleet.add_head("south", "192.168.1.51", 4000, plan.load("south.conf"))
+fleet.start()
+...
+fleet.health()
+fleet.metrics()
+fleet.stop()
+"""
+
+import threading
+import time
+from pyflirpt.utils import ptlogger
+from pyflirpt.utils.ptbackoff import BackoffPolicy
+from pyflirpt.keyboard.keyboard import KeyboardController
+
+# Health states of a head
+CONNECTING = "connecting"
+OK = "ok"
+DEGRADED = "degraded"
+DOWN = "down"
+STOPPED = "stopped"
+
+
+class Head(object):
+    """
+    State of one pan and tilt in the fleet
+
+    Attributes
+    ----------
+    name : str
+    pt_ip, pt_port : str, int
+        address of the pan and tilt
+    plan : iterable of (pan, tilt, zoom)
+        positions scanned in a loop
+    state : str {'connecting', 'ok', 'degraded', 'down', 'stopped'}
+        `degraded` after a move that timed out,
+        `down` while waiting to reconnect
+    failures : int
+        consecutive failures, reset by a successful move
+    last_error : str
+    moves, cycles : int
+        completed moves and scan cycles
+    busy : float
+        seconds spent moving and waiting for the head
+    """
+    def __init__(self, name, pt_ip, pt_port, plan):
+        self.name = name
+        self.pt_ip = pt_ip
+        self.pt_port = pt_port
+        self.plan = plan
+        self.state = CONNECTING
+        self.failures = 0
+        self.last_error = None
+        self.moves = 0
+        self.cycles = 0
+        self.busy = 0.0
+        self.controller = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def health(self):
+        return {"state": self.state, "failures": self.failures,
+                "last_error": self.last_error, "moves": self.moves,
+                "cycles": self.cycles}
+
+
+class FleetController(object):
+    """
+    Owns N pan and tilt controllers and runs a scan plan on each
+
+    Parameters
+    ----------
+    backoff : BackoffPolicy, optional
+        reconnect policy shared by every head
+    controller_factory : callable, optional
+        `factory(pt_ip, pt_port)` returning a connected controller
+        (default: KeyboardController)
+    move_timeout : float, optional
+        seconds to wait for a head to reach a position. By default
+        derived from the move time predicted by each controller
+    """
+    def __init__(self, backoff=None, controller_factory=KeyboardController, move_timeout=None):
+        self.logger = ptlogger.ptlogger(tofile=True)
+        self.backoff = backoff or BackoffPolicy()
+        self.controller_factory = controller_factory
+        self.move_timeout = move_timeout
+        self.heads = {}
+        self.started = None
+        self._lock = threading.Lock()
+
+    def add_head(self, name, pt_ip, pt_port, plan):
+        """
+        Add a head. Its worker starts right away if the fleet is running
+        """
+        head = Head(name, pt_ip, pt_port, plan)
+        with self._lock:
+            if name in self.heads:
+                raise ValueError("Head already in fleet: "+str(name))
+            self.heads[name] = head
+        if self.started is not None:
+            self._startHead(head)
+        return head
+
+    def remove_head(self, name, timeout=None):
+        """
+        Stop the head's worker and drop it from the fleet
+        """
+        with self._lock:
+            head = self.heads.pop(name)
+        self._stopHead(head, timeout)
+
+    def start(self):
+        """
+        Start a worker for every head
+        """
+        self.started = time.time()
+        for head in list(self.heads.values()):
+            self._startHead(head)
+
+    def stop(self, timeout=None):
+        """
+        Stop every worker and close the connections
+        """
+        heads = list(self.heads.values())
+        for head in heads:
+            head.stop_event.set()
+        for head in heads:
+            self._stopHead(head, timeout)
+        self.started = None
+
+    def health(self):
+        """
+        Returns the health of every head, keyed by name
+        """
+        return dict((name, head.health()) for name, head in self.heads.items())
+
+    def metrics(self):
+        """
+        Returns aggregate throughput of the fleet
+
+        Returns
+        -------
+        metrics : dict
+            heads, heads per state, total moves and cycles,
+            moves per second since `start` and mean seconds per move
+        """
+        heads = list(self.heads.values())
+        moves = sum(head.moves for head in heads)
+        busy = sum(head.busy for head in heads)
+        elapsed = time.time() - self.started if self.started else 0
+        states = {}
+        for head in heads:
+            states[head.state] = states.get(head.state, 0) + 1
+        return {"heads": len(heads), "states": states, "moves": moves,
+                "cycles": sum(head.cycles for head in heads),
+                "moves_per_sec": moves / elapsed if elapsed else 0.0,
+                "seconds_per_move": busy / moves if moves else 0.0}
+
+    def _startHead(self, head):
+        head.stop_event.clear()
+        head.thread = threading.Thread(target=self._runHead, args=(head,),
+                                       name="FleetHead-%s" % head.name)
+        head.thread.daemon = True
+        head.thread.start()
+
+    def _stopHead(self, head, timeout=None):
+        head.stop_event.set()
+        if head.thread is not None:
+            head.thread.join(timeout)
+        self._disconnect(head)
+        head.state = STOPPED
+
+    def _disconnect(self, head):
+        if head.controller is not None:
+            try:
+                head.controller.cleanup()
+            except Exception as ex:
+                self.logger.error("%s: error closing: %s" % (head.name, str(ex)))
+            head.controller = None
+
+    def _fail(self, head, ex):
+        head.failures += 1
+        head.last_error = str(ex)
+        head.state = DOWN
+        self.logger.warning("%s: %s, failure %d" % (head.name, str(ex), head.failures))
+        self._disconnect(head)
+        head.stop_event.wait(self.backoff.delay(head.failures - 1))
+
+    def _runHead(self, head):
+        while not head.stop_event.is_set():
+            if head.controller is None:
+                head.state = CONNECTING
+                try:
+                    head.controller = self.controller_factory(head.pt_ip, head.pt_port)
+                except Exception as ex:
+                    self._fail(head, ex)
+                    continue
+            try:
+                for pan, tilt, zoom in head.plan:
+                    if head.stop_event.is_set():
+                        return
+                    start = time.time()
+                    head.controller.move_to(pan, tilt)
+                    ready, polls = head.controller.wait_until_ready(timeout=self.move_timeout)
+                    head.busy += time.time() - start
+                    if ready:
+                        head.moves += 1
+                        head.failures = 0
+                        head.state = OK
+                    else:
+                        head.state = DEGRADED
+                head.cycles += 1
+            except Exception as ex:
+                self._fail(head, ex)
@@ -0,0 +1,255 @@
+# -* coding: utf-8 -*-
+"""
+Compiled scan plans.
+
+A `movement.conf` file is parsed and validated once into a `ScanPlan`
+holding pan, tilt and zoom as `array('i')` columns. The compiled plan
+is cached next to the source (`.movement.conf.plan`) and reused for as
+long as the source's mtime and size are unchanged.
+
+Only the first whitespace separated field of a line is the position,
+anything after it is left to `scan.scheduler` (revisit, dwell and
+priority settings).
+
+Usage:
+------
+plan = load("movement.conf")
+for pan, tilt, zoom in plan:
+    ...
+"""
+
+import os
+import struct
+import sys
+from array import array
+
+# Pan and Tilt limits of the E series, as in KeyboardController
+PAN_LIMITS = (-4000, 4000)
+TILT_LIMITS = (-2100, 2100)
+
+_MAGIC = b"PTPLAN01"
+_HEADER = struct.Struct("<8sqqI")
+
+
+class PlanError(ValueError):
+    """
+    Raised when a scan plan has lines that cannot be parsed or
+    positions beyond the limits. `errors` lists one message per
+    bad line, prefixed with its line number
+    """
+    def __init__(self, path, errors):
+        self.path = path
+        self.errors = errors
+        ValueError.__init__(self, "%s:\n  %s" % (path, "\n  ".join(errors)))
+
+
+def parse_position(line):
+    """
+    Parse a `movement.conf` line such as `n3800_p200,1`
+    (`n` for negative and `p` for positive values)
+
+    Returns
+    -------
+    (pan, tilt, zoom) : tuple of int
+    """
+    def _signed(value):
+        if value.startswith("n"):
+            return -int(value[1:])
+        return int(value[1:] if value.startswith("p") else value)
+
+    posn, zoom = line.strip().split(",")
+    pan, tilt = posn.split("_")
+    return (_signed(pan), _signed(tilt), int(zoom))
+
+
+def format_position(target):
+    """
+    Format a (pan, tilt, zoom) target as a `movement.conf` line
+    """
+    def _signed(value):
+        return ("n%d" if value < 0 else "p%d") % abs(value)
+
+    pan, tilt, zoom = target
+    return "%s_%s,%d" % (_signed(pan), _signed(tilt), zoom)
+
+
+class ScanPlan(object):
+    """
+    Scan positions stored column wise
+
+    Attributes
+    ----------
+    pan, tilt, zoom : array('i')
+        target of every position
+    lines : array('i')
+        line number of every position in the source file
+    """
+    def __init__(self, pan=None, tilt=None, zoom=None, lines=None):
+        self.pan = pan if pan is not None else array("i")
+        self.tilt = tilt if tilt is not None else array("i")
+        self.zoom = zoom if zoom is not None else array("i")
+        self.lines = lines if lines is not None else array("i", range(1, len(self.pan) + 1))
+
+    @classmethod
+    def from_targets(cls, targets):
+        """
+        Build a plan from an iterable of (pan, tilt, zoom)
+        """
+        plan = cls()
+        for lineno, (pan, tilt, zoom) in enumerate(targets, 1):
+            plan.append(pan, tilt, zoom, lineno)
+        return plan
+
+    def append(self, pan, tilt, zoom, lineno=None):
+        self.pan.append(pan)
+        self.tilt.append(tilt)
+        self.zoom.append(zoom)
+        self.lines.append(lineno if lineno is not None else len(self.lines) + 1)
+
+    def __len__(self):
+        return len(self.pan)
+
+    def __getitem__(self, index):
+        return (self.pan[index], self.tilt[index], self.zoom[index])
+
+    def __iter__(self):
+        return zip(self.pan, self.tilt, self.zoom)
+
+    def validate(self, pan_limits=PAN_LIMITS, tilt_limits=TILT_LIMITS):
+        """
+        Returns one message per position beyond the limits
+        """
+        errors = []
+        for i in range(len(self)):
+            if not pan_limits[0] <= self.pan[i] <= pan_limits[1]:
+                errors.append("line %d: pan %d beyond limits %s" % (
+                    self.lines[i], self.pan[i], pan_limits))
+            if not tilt_limits[0] <= self.tilt[i] <= tilt_limits[1]:
+                errors.append("line %d: tilt %d beyond limits %s" % (
+                    self.lines[i], self.tilt[i], tilt_limits))
+        return errors
+
+    def _columns(self):
+        return (self.pan, self.tilt, self.zoom, self.lines)
+
+    def to_bytes(self, mtime=0, size=0):
+        """
+        Serialise the plan, tagged with the source's mtime and size
+        """
+        chunks = [_HEADER.pack(_MAGIC, mtime, size, len(self))]
+        for column in self._columns():
+            if sys.byteorder != "little":
+                column = array("i", column)
+                column.byteswap()
+            chunks.append(column.tobytes())
+        return b"".join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Load a plan serialised with `to_bytes`
+
+        Returns
+        -------
+        (plan, mtime, size) : tuple
+        """
+        magic, mtime, size, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("Not a compiled scan plan")
+        columns = []
+        offset = _HEADER.size
+        for i in range(4):
+            column = array("i")
+            end = offset + count * column.itemsize
+            column.frombytes(data[offset:end])
+            if sys.byteorder != "little":
+                column.byteswap()
+            columns.append(column)
+            offset = end
+        if len(columns[-1]) != count:
+            raise ValueError("Truncated compiled scan plan")
+        return cls(*columns), mtime, size
+
+
+def compile_plan(path):
+    """
+    Parse a `movement.conf` style file
+
+    Returns
+    -------
+    (plan, errors) : tuple
+        the positions that parsed and one message per bad line
+    """
+    plan = ScanPlan()
+    errors = []
+    with open(path, "r") as c_handler:
+        for lineno, line in enumerate(c_handler, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            try:
+                pan, tilt, zoom = parse_position(line.split()[0])
+            except ValueError:
+                errors.append("line %d: cannot parse %r" % (lineno, line.strip()))
+                continue
+            plan.append(pan, tilt, zoom, lineno)
+    return plan, errors
+
+
+def cache_path(path):
+    head, tail = os.path.split(path)
+    return os.path.join(head, "." + tail + ".plan")
+
+
+def load(path, pan_limits=PAN_LIMITS, tilt_limits=TILT_LIMITS, cache=True):
+    """
+    Load a scan plan, reusing the compiled cache when the
+    source file has not changed
+
+    Parameters
+    ----------
+    path : str
+        `movement.conf` style file
+    pan_limits, tilt_limits : (min, max), optional
+        positions beyond these are reported as errors
+    cache : bool, optional
+        read and write the compiled cache (default: True)
+
+    Returns
+    -------
+    plan : ScanPlan
+
+    Raises
+    ------
+    PlanError
+        listing every bad line with its line number
+    """
+    stat = os.stat(path)
+    mtime, size = stat.st_mtime_ns, stat.st_size
+    plan = None
+    errors = []
+    if cache:
+        try:
+            with open(cache_path(path), "rb") as p_handler:
+                cached, cached_mtime, cached_size = ScanPlan.from_bytes(p_handler.read())
+            if (cached_mtime, cached_size) == (mtime, size):
+                plan = cached
+        except (IOError, OSError, ValueError, struct.error):
+            # Missing or stale cache, compile from source
+            pass
+    compiled = plan is None
+    if compiled:
+        plan, errors = compile_plan(path)
+    errors += plan.validate(pan_limits, tilt_limits)
+    if errors:
+        errors.sort(key=lambda error: int(error.split(":")[0].split()[1]))
+        raise PlanError(path, errors)
+    if cache and compiled:
+        tmp = cache_path(path) + ".tmp"
+        try:
+            with open(tmp, "wb") as p_handler:
+                p_handler.write(plan.to_bytes(mtime, size))
+            os.replace(tmp, cache_path(path))
+        except (IOError, OSError):
+            # Cache is only an optimisation
+            pass
+    return plan
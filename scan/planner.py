@@ -0,0 +1,137 @@
+# -* coding: utf-8 -*-
+"""
+Scan path planner: orders a set of (pan, tilt, zoom) targets to
+minimise the total slew time of one scan cycle.
+
+The tour is closed (the scan loop cycles forever) and is built with
+a nearest neighbour pass followed by 2-opt improvement. Both axes move
+at the same time, so the cost of a hop is the time taken by the slower
+axis at its own speed, or the move time predicted by a calibrated
+`keyboard.kinematics.MotionModel` when one is passed.
+
+Usage:
+------
+python -m pyflirpt.scan.planner movement.conf -o movement.optimized.conf
+"""
+
+import argparse
+from pyflirpt.scan.plan import load, format_position
+
+
+def slew_time(a, b, pan_speed, tilt_speed, model=None):
+    """
+    Seconds needed to slew from target `a` to target `b`
+    with both axes moving at their own speed
+    """
+    if model is not None:
+        return model.estimate(a, b, pan_speed, tilt_speed)
+    return max(abs(b[0] - a[0]) / float(pan_speed),
+               abs(b[1] - a[1]) / float(tilt_speed))
+
+
+def cycle_time(targets, pan_speed, tilt_speed, dwell=0.0, model=None):
+    """
+    Seconds needed to visit every target in order and
+    return to the first one
+
+    Parameters
+    ----------
+    targets : list of (pan, tilt, zoom)
+    pan_speed, tilt_speed : float
+        slew speed of each axis in positions per second
+    dwell : float, optional
+        seconds spent at each target
+    model : MotionModel, optional
+        predicts the slew times, constant speed if not passed
+    """
+    total = dwell * len(targets)
+    for i in range(len(targets)):
+        total += slew_time(targets[i - 1], targets[i], pan_speed, tilt_speed, model)
+    return total
+
+
+def _nearestNeighbour(cost, start):
+    size = len(cost)
+    tour = [start]
+    left = set(range(size))
+    left.discard(start)
+    while left:
+        last = cost[tour[-1]]
+        nearest = min(left, key=lambda j: last[j])
+        tour.append(nearest)
+        left.discard(nearest)
+    return tour
+
+
+def _twoOpt(tour, cost):
+    size = len(tour)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(size - 1):
+            a, b = tour[i], tour[i + 1]
+            cost_a = cost[a]
+            cost_b = cost[b]
+            for j in range(i + 2, size if i else size - 1):
+                c, d = tour[j], tour[(j + 1) % size]
+                delta = cost_a[c] + cost_b[d] - cost_a[b] - cost[c][d]
+                if delta < -1e-9:
+                    tour[i + 1:j + 1] = reversed(tour[i + 1:j + 1])
+                    b = tour[i + 1]
+                    cost_b = cost[b]
+                    improved = True
+    return tour
+
+
+def plan(targets, pan_speed=150, tilt_speed=150, start=0, model=None):
+    """
+    Order targets to minimise the slew time of a closed scan cycle
+
+    Parameters
+    ----------
+    targets : list of (pan, tilt, zoom)
+    pan_speed, tilt_speed : float, optional
+        slew speed of each axis in positions per second
+        (default: 150, the speed set by `KeyboardController.resetPT`)
+    start : int, optional
+        index of the target the cycle starts from (default: 0)
+    model : MotionModel, optional
+        predicts the slew times, e.g. `KeyboardController.motion`
+        once calibrated. Constant speed if not passed
+
+    Returns
+    -------
+    (ordered, seconds) : tuple
+        targets in visiting order and the estimated slew time
+        of one cycle
+    """
+    targets = list(targets)
+    if len(targets) < 4:
+        return targets, cycle_time(targets, pan_speed, tilt_speed, model=model)
+    cost = [[slew_time(a, b, pan_speed, tilt_speed, model) for b in targets] for a in targets]
+    tour = _twoOpt(_nearestNeighbour(cost, start), cost)
+    ordered = [targets[i] for i in tour]
+    return ordered, cycle_time(ordered, pan_speed, tilt_speed, model=model)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Optimise the order of a scan plan")
+    parser.add_argument("config", help="movement.conf style file")
+    parser.add_argument("-o", "--output", help="file to write the optimised plan to")
+    parser.add_argument("--pan-speed", type=float, default=150)
+    parser.add_argument("--tilt-speed", type=float, default=150)
+    args = parser.parse_args()
+
+    targets = list(load(args.config, cache=False))
+    before = cycle_time(targets, args.pan_speed, args.tilt_speed)
+    ordered, after = plan(targets, args.pan_speed, args.tilt_speed)
+    print("Targets          : %d" % len(targets))
+    print("Cycle time before: %.1f s" % before)
+    print("Cycle time after : %.1f s" % after)
+    if args.output:
+        with open(args.output, "w") as o_handler:
+            o_handler.write("\n".join(format_position(t) for t in ordered) + "\n")
+
+
+if __name__ == "__main__":
+    main()
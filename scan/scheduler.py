@@ -0,0 +1,343 @@
+# -* coding: utf-8 -*-
+"""
+Scan scheduling by revisit interval, dwell time and priority.
+
+Instead of cycling through one fixed list, every target asks to be
+visited again `revisit` seconds after its last visit, and is held
+for `dwell` seconds once reached. The next target is the one with
+the least slack, the time left before it has to leave (deadline
+minus slew time from the current position, predicted by the
+controller's `MotionModel`), with the slack weighted by `priority`:
+divided by it while positive and multiplied by it once overdue, so
+when not every deadline can be met the high priority targets are
+served first.
+
+Moves start just early enough to arrive at the deadline, so targets
+are never visited more often than requested. Targets with `revisit`
+0 have no deadline: they fill the time in between, least recently
+visited first, and only when visiting one still lets every other
+target make its deadline. With only such targets the scan runs as
+fast as the slews allow.
+
+A schedule file holds one `movement.conf` position per line, with
+optional settings overriding the defaults:
+
+    n3800_p200,1 revisit=30 dwell=2 priority=3
+    n3025_p200,1
+
+Usage:
+------
+python -m pyflirpt.scan.scheduler schedule.conf --duration 60
+"""
+
+import argparse
+import time
+from pyflirpt.utils import ptlogger
+from pyflirpt.scan.plan import PlanError, load
+from pyflirpt.scan.planner import slew_time
+
+# Settings of a target that the schedule file can override
+_SETTINGS = ("revisit", "dwell", "priority")
+# Seconds past its revisit interval after which a visit counts as late
+LATE_TOLERANCE = 1.0
+
+
+class Target(object):
+    """
+    A scan position with its schedule and visit statistics
+
+    Attributes
+    ----------
+    pan, tilt, zoom : int
+        position
+    revisit : float
+        requested seconds between visits
+    dwell : float
+        seconds to stay once reached
+    priority : float
+        weight of the slack, >= 1
+    deadline : float
+        time.time() by which the next visit is due, the time of
+        the last visit for targets with `revisit` 0
+    visits : int
+        visits so far
+    first, last : float
+        time of the first and last visit
+    longest : float
+        longest interval between two visits
+    late : int
+        visits that came more than LATE_TOLERANCE seconds after
+        the revisit interval
+    """
+    __slots__ = ("index", "pan", "tilt", "zoom", "revisit", "dwell", "priority",
+                 "deadline", "visits", "first", "last", "longest", "late")
+
+    def __init__(self, pan, tilt, zoom=0, revisit=0.0, dwell=0.0, priority=1, index=0):
+        if revisit < 0 or dwell < 0 or priority < 1:
+            raise ValueError("Bad schedule: revisit=%s dwell=%s priority=%s" % (
+                revisit, dwell, priority))
+        self.index = index
+        self.pan = pan
+        self.tilt = tilt
+        self.zoom = zoom
+        self.revisit = float(revisit)
+        self.dwell = float(dwell)
+        self.priority = float(priority)
+        self.deadline = None
+        self.visits = 0
+        self.first = self.last = None
+        self.longest = 0.0
+        self.late = 0
+
+    @property
+    def position(self):
+        return (self.pan, self.tilt, self.zoom)
+
+    def achieved(self):
+        """
+        Returns the mean seconds between visits, None before the
+        second visit
+        """
+        if self.visits < 2:
+            return None
+        return (self.last - self.first) / (self.visits - 1)
+
+    def __repr__(self):
+        return "Target(pan=%d, tilt=%d, zoom=%d, revisit=%g, dwell=%g, priority=%g)" % (
+            self.pan, self.tilt, self.zoom, self.revisit, self.dwell, self.priority)
+
+
+def load_targets(path, revisit=0.0, dwell=0.0, priority=1, cache=True):
+    """
+    Read a schedule file. A plain `movement.conf` is a valid
+    schedule, every target then gets the defaults
+
+    Parameters
+    ----------
+    path : str
+        schedule file
+    revisit, dwell, priority : optional
+        settings of the targets that do not override them
+    cache : bool, optional
+        reuse the compiled plan of the positions (default: True)
+
+    Returns
+    -------
+    targets : list of Target
+
+    Raises
+    ------
+    PlanError
+        listing every bad line with its line number
+    """
+    positions = load(path, cache=cache)
+    with open(path, "r") as s_handler:
+        lines = s_handler.readlines()
+    targets = []
+    errors = []
+    for index, (pan, tilt, zoom) in enumerate(positions):
+        lineno = positions.lines[index]
+        settings = {"revisit": revisit, "dwell": dwell, "priority": priority}
+        try:
+            for field in lines[lineno - 1].split()[1:]:
+                key, value = field.split("=")
+                if key not in _SETTINGS:
+                    raise ValueError(key)
+                settings[key] = float(value)
+            targets.append(Target(pan, tilt, zoom, index=index, **settings))
+        except ValueError:
+            errors.append("line %d: cannot parse %r" % (lineno, lines[lineno - 1].strip()))
+    if errors:
+        raise PlanError(path, errors)
+    return targets
+
+
+class Scheduler(object):
+    """
+    Picks the next target to visit and keeps the visit statistics
+
+    Parameters
+    ----------
+    targets : list of Target
+    pan_speed, tilt_speed : float, optional
+        slew speed of each axis (default: 2000, the maximum)
+    model : MotionModel, optional
+        predicts the slew times, e.g. `KeyboardController.motion`.
+        Constant speed if not passed
+    """
+    def __init__(self, targets, pan_speed=2000, tilt_speed=2000, model=None):
+        if not targets:
+            raise ValueError("Nothing to schedule")
+        self.logger = ptlogger.ptlogger(tofile=True)
+        self.targets = list(targets)
+        self.pan_speed = pan_speed
+        self.tilt_speed = tilt_speed
+        self.model = model
+        self.failed = 0
+
+    def slew(self, position, target):
+        if position is None:
+            return 0.0
+        return slew_time(position, target.position, self.pan_speed, self.tilt_speed, self.model)
+
+    def choose(self, position, now):
+        """
+        Returns (target, slew seconds) of the next visit from `position`
+        """
+        timed = []
+        fillers = []
+        for target in self.targets:
+            if target.deadline is None:
+                target.deadline = now
+            slew = self.slew(position, target)
+            if target.revisit:
+                slack = target.deadline - slew - now
+                if slack > 0:
+                    key = slack / target.priority
+                else:
+                    key = slack * target.priority
+                timed.append((key, target, slew))
+            else:
+                fillers.append((target.deadline + slew, target, slew))
+        fillers.sort(key=lambda candidate: candidate[0])
+        if not timed:
+            return fillers[0][1], fillers[0][2]
+        for key, target, slew in fillers:
+            # Staying put is no visit, wait for a deadline instead
+            if position is not None and tuple(position[:2]) == (target.pan, target.tilt):
+                continue
+            if self._fits(target, now + slew + target.dwell, timed):
+                return target, slew
+        key, target, slew = min(timed, key=lambda candidate: candidate[0])
+        return target, slew
+
+    def _fits(self, filler, free, timed):
+        """
+        Whether every target with a deadline can still make it
+        when leaving `filler` at `free`
+        """
+        for key, target, slew in timed:
+            if free + self.slew(filler.position, target) > target.deadline:
+                return False
+        return True
+
+    def _nextStart(self, position, now):
+        """
+        Seconds until the first target with a deadline has to leave
+        """
+        return min(target.deadline - self.slew(position, target) - now
+                   for target in self.targets if target.revisit)
+
+    def visited(self, target, when):
+        """
+        Record a visit of `target` at `when` and set its next deadline
+        """
+        if target.last is not None:
+            interval = when - target.last
+            target.longest = max(target.longest, interval)
+            if target.revisit and interval > target.revisit + LATE_TOLERANCE:
+                target.late += 1
+        else:
+            target.first = when
+        target.last = when
+        target.visits += 1
+        target.deadline = when + target.revisit
+
+    def run(self, executor, duration=None, visits=None):
+        """
+        Visit targets with a `ScanExecutor` until `duration` seconds
+        or `visits` visits have passed, forever if neither is passed
+
+        Returns
+        -------
+        visits : int
+            number of targets reached
+        """
+        controller = executor.controller
+        position = executor.position or controller.current_pos(max_age=0)
+        stop = None if duration is None else time.time() + duration
+        done = 0
+        while (stop is None or time.time() < stop) and (visits is None or done < visits):
+            now = time.time()
+            target, slew = self.choose(position, now)
+            if target.revisit and target.deadline - slew > now:
+                # Nothing due and no filler fits: wait for the first
+                # target that has to leave, then choose again
+                wait = self._nextStart(position, now)
+                if stop is not None and now + wait >= stop:
+                    break
+                time.sleep(wait)
+                continue
+            ready, polls = executor.step(target.position, target.index)
+            if not ready:
+                self.failed += 1
+                self.logger.warning("%r not reached" % target)
+                position = None
+                # Retry it after the others due now
+                target.deadline = time.time() + target.revisit
+                continue
+            self.visited(target, time.time())
+            position = target.position
+            done += 1
+            if target.dwell:
+                time.sleep(target.dwell)
+        return done
+
+    def report(self):
+        """
+        Requested against achieved revisit interval of every target
+
+        Returns
+        -------
+        rows : list of (Target, requested seconds, achieved seconds)
+            achieved is None for targets visited less than twice
+        """
+        return [(target, target.revisit, target.achieved()) for target in self.targets]
+
+    def format_report(self):
+        lines = ["%-5s %-18s %4s %8s %10s %10s %9s %6s" % (
+            "index", "position", "prio", "visits", "requested", "achieved", "longest", "late")]
+        for target, requested, achieved in self.report():
+            lines.append("%-5d %-18s %4g %8d %9.1fs %10s %8.1fs %6d" % (
+                target.index, "%d, %d" % (target.pan, target.tilt), target.priority,
+                target.visits, requested,
+                "-" if achieved is None else "%.1fs" % achieved,
+                target.longest, target.late))
+        return "\n".join(lines)
+
+
+def main():
+    from pyflirpt.keyboard.keyboard import KeyboardController
+    from pyflirpt.scan.executor import ScanExecutor
+    from pyflirpt.utils import ptsimulator
+    parser = argparse.ArgumentParser(description="Run a scan schedule and report revisit rates")
+    parser.add_argument("config", help="schedule or movement.conf style file")
+    parser.add_argument("--host", help="use real hardware instead of the simulator")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--latency", type=float, default=0, help="simulated seconds per reply packet")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run")
+    parser.add_argument("--revisit", type=float, default=0, help="default seconds between visits")
+    parser.add_argument("--dwell", type=float, default=0, help="default seconds at each target")
+    args = parser.parse_args()
+
+    sim = None
+    if args.host:
+        address = (args.host, args.port)
+    else:
+        sim = ptsimulator.PTSimulator(latency=args.latency)
+        address = sim.start()
+    targets = load_targets(args.config, args.revisit, args.dwell)
+    controller = KeyboardController(*address)
+    executor = ScanExecutor(controller, [])
+    scheduler = Scheduler(targets, executor.max_pan_speed, executor.max_tilt_speed,
+                          model=controller.motion)
+    visits = scheduler.run(executor, duration=args.duration)
+    print("Visits in %.0f s: %d (%d failed)" % (args.duration, visits, scheduler.failed))
+    print(scheduler.format_report())
+    controller.cleanup()
+    if sim:
+        sim.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import atexit
+import time
+
+from pyflirpt.keyboard.keyboard import KeyboardController
+from pyflirpt.scan.fleet import FleetController, OK
+from pyflirpt.utils.ptbackoff import BackoffPolicy
+
+
+def test_reconnects_do_not_leak_exit_handlers(simulator, monkeypatch):
+    controllers = []
+    handlers = []
+    monkeypatch.setattr(atexit, "register", handlers.append)
+    monkeypatch.setattr(atexit, "unregister", handlers.remove)
+
+    def factory(pt_ip, pt_port):
+        controller = KeyboardController(pt_ip, pt_port, timeout=2)
+        if not controllers:
+            # The first connection fails on its first move
+            def move_to(*args, **kwargs):
+                raise IOError("link down")
+            controller.move_to = move_to
+        controllers.append(controller)
+        return controller
+
+    fleet = FleetController(backoff=BackoffPolicy(base=0.01), controller_factory=factory)
+    head = fleet.add_head("sim", simulator.host, simulator.port, [(20, 0, 0), (0, 0, 0)])
+    fleet.start()
+    deadline = time.time() + 5
+    while head.moves < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    fleet.stop()
+    assert head.moves >= 2
+    assert len(controllers) == 2
+    assert handlers == []
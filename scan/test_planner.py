@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import itertools
+import random
+
+from pyflirpt.scan.planner import cycle_time, plan
+
+
+def test_two_opt_uncrosses_square():
+    # Nearest neighbour from the origin gives a crossing tour here
+    corners = [(0, 0, 0), (1000, 1000, 0), (0, 1000, 0), (1000, 0, 0), (500, 1100, 0)]
+    ordered, seconds = plan(corners, 100, 100)
+    assert seconds < cycle_time(corners, 100, 100)
+    assert ordered[0] == corners[0]
+    assert sorted(ordered) == sorted(corners)
+
+
+def test_plan_matches_brute_force_on_small_sets():
+    rng = random.Random(7)
+    for trial in range(5):
+        targets = [(rng.randint(-4000, 4000), rng.randint(-2100, 2100), 0) for i in range(7)]
+        best = min(cycle_time([targets[0]] + list(rest), 150, 150)
+                   for rest in itertools.permutations(targets[1:]))
+        ordered, seconds = plan(targets, 150, 150)
+        # 2-opt is a local search, allow a little slack over the optimum
+        assert seconds <= best * 1.1 + 1e-9
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from pyflirpt.keyboard.keyboard import KeyboardController
+from pyflirpt.scan.executor import ScanExecutor
+from pyflirpt.scan.scheduler import Scheduler, Target
+
+
+@pytest.fixture
+def executor(simulator):
+    kctrl = KeyboardController(simulator.host, simulator.port, timeout=2)
+    yield ScanExecutor(kctrl, [])
+    kctrl.cleanup()
+
+
+def _run(executor, targets, duration):
+    scheduler = Scheduler(targets, executor.max_pan_speed, executor.max_tilt_speed,
+                          model=executor.controller.motion)
+    scheduler.run(executor, duration=duration)
+    return scheduler
+
+
+def test_revisit_intervals_kept_with_filler(executor):
+    urgent = Target(100, 0, revisit=1.0, priority=3, index=0)
+    relaxed = Target(-100, 0, revisit=2.0, index=1)
+    filler = Target(0, 50, index=2)
+    _run(executor, [urgent, relaxed, filler], duration=4.5)
+    for target in (urgent, relaxed):
+        assert target.late == 0
+        assert target.revisit - 0.25 <= target.achieved() <= target.revisit + 0.25
+    # The idle time between deadlines goes to the filler
+    assert filler.visits > 0
+
+
+def test_priority_served_first_when_overloaded(executor):
+    targets = [Target(100 * i, 0, revisit=1.0, dwell=0.4, priority=3 if i == 0 else 1,
+                      index=i) for i in range(-1, 2)]
+    _run(executor, targets, duration=3.0)
+    high = targets[1]
+    assert high.priority == 3
+    assert high.late == 0
+    for target in targets:
+        assert target.visits <= high.visits
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module defines the jittered exponential backoff used
+between reconnect attempts to a pan and tilt.
+"""
+
+import random
+
+
+class BackoffPolicy(object):
+    """
+    Jittered exponential backoff
+
+    The n-th delay (starting at 0) is drawn uniformly from
+    `[(1 - jitter) * d, d]` with `d = min(max_delay, base * factor ** n)`,
+    so that heads failing together do not retry in lockstep.
+
+    Parameters
+    ----------
+    base : float, optional
+        first delay in seconds (default: 0.5)
+    factor : float, optional
+        growth of the delay per attempt (default: 2)
+    max_delay : float, optional
+        cap on the delay in seconds (default: 30)
+    jitter : float, optional
+        fraction of the delay that is randomised, 0..1 (default: 0.5)
+    max_attempts : int, optional
+        attempts after which `delays` stops. None retries forever
+    """
+    def __init__(self, base=0.5, factor=2.0, max_delay=30.0, jitter=0.5, max_attempts=None):
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+
+    def delay(self, attempt):
+        """
+        Seconds to wait before retry number `attempt` (0 based)
+        """
+        # Exponent capped so long outages cannot overflow the float
+        delay = min(self.max_delay, self.base * self.factor ** min(attempt, 64))
+        return random.uniform((1 - self.jitter) * delay, delay)
+
+    def delays(self):
+        """
+        Generator of successive delays, `max_attempts` of them
+        """
+        attempt = 0
+        while self.max_attempts is None or attempt < self.max_attempts:
+            yield self.delay(attempt)
+            attempt += 1
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module defines a persistent connection to the pan and tilt
+along with a small pool so that every caller talking to the same
+device shares one socket instead of spawning a new process per command.
+"""
+
+import atexit
+import socket
+import subprocess
+import threading
+import time
+from pyflirpt.utils import ptjournal, ptlogger, ptmetrics, ptprotocol
+
+# Clock for latencies, unaffected by wall clock changes (Python 3)
+_clock = getattr(time, "monotonic", time.time)
+
+
+class SSHTunnel(object):
+    """
+    Long lived ssh port forward to a pan and tilt that is only
+    reachable through a jump host.
+
+    Parameters
+    ----------
+    host : str
+        ssh host that can reach the pan and tilt
+    remote_host : str
+        ip address of the pan and tilt as seen from `host`
+    remote_port : int
+        port number of the pan and tilt as seen from `host`
+    local_port : int, optional
+        local port to forward. A free port is picked if not passed
+    timeout : float, optional
+        seconds to wait for the tunnel to accept connections
+    """
+    def __init__(self, host, remote_host, remote_port, local_port=None, timeout=10):
+        self.logger = ptlogger.ptlogger(tofile=True)
+        self.host = host
+        self.remote_host = remote_host
+        self.remote_port = int(remote_port)
+        self.local_port = local_port or self._freePort()
+        self.timeout = timeout
+        self.proc = None
+
+    def _freePort(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def alive(self):
+        """
+        Returns True if the ssh process backing the tunnel is running
+        """
+        return self.proc is not None and self.proc.poll() is None
+
+    def open(self):
+        """
+        Start the ssh process (if not already running) and wait
+        until the forwarded port accepts connections
+
+        Returns
+        -------
+        (host, port) : tuple
+            local address to connect to
+        """
+        if not self.alive():
+            self.logger.info("Opening ssh tunnel through %s" % self.host)
+            self.proc = subprocess.Popen(
+                ['ssh', '-N',
+                 '-o', 'ExitOnForwardFailure=yes',
+                 '-o', 'ServerAliveInterval=3',
+                 '-L', '%d:%s:%d' % (self.local_port, self.remote_host, self.remote_port),
+                 self.host])
+            deadline = time.time() + self.timeout
+            while time.time() < deadline:
+                if not self.alive():
+                    raise IOError("ssh tunnel through %s exited" % self.host)
+                try:
+                    socket.create_connection(("127.0.0.1", self.local_port), 0.5).close()
+                    break
+                except socket.error:
+                    time.sleep(0.1)
+            else:
+                self.close()
+                raise IOError("Timed out opening ssh tunnel through %s" % self.host)
+        return ("127.0.0.1", self.local_port)
+
+    def close(self):
+        """
+        Stop the ssh process
+        """
+        if self.alive():
+            self.logger.warning("Closing ssh tunnel through %s" % self.host)
+            self.proc.terminate()
+            self.proc.wait()
+        self.proc = None
+
+
+class PTConnection(object):
+    """
+    Persistent TCP connection to the pan and tilt.
+
+    Commands are written with the protocol's `\\r\\n` framing and one
+    reply line is read back for every whitespace separated command.
+    A dropped connection is reopened transparently and the command
+    is sent once more if it is idempotent (see
+    `ptprotocol.IDEMPOTENT_COMMANDS`), otherwise IOError is raised.
+
+    Parameters
+    ----------
+    host : str
+        ip address of the pan and tilt
+    port : int
+        port number of the pan and tilt
+    via : str, optional
+        ssh host to tunnel through when the pan and tilt is not
+        directly reachable
+    timeout : float, optional
+        socket timeout in seconds
+    journal : ptjournal.Journal, optional
+        where to record every exchange
+    """
+    cursor = b"*"
+    sentinel = b"\r\n"
+
+    def __init__(self, host, port, via=None, timeout=5, metrics=None, journal=None):
+        self.logger = ptlogger.ptlogger(tofile=True)
+        self.metrics = metrics if metrics is not None else ptmetrics.registry
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.tunnel = SSHTunnel(via, host, port) if via else None
+        self.reader = None
+        self._lock = threading.Lock()
+        self.journal = journal
+
+    def _address(self):
+        if self.tunnel:
+            return self.tunnel.open()
+        return (self.host, self.port)
+
+    def open(self):
+        """
+        Open the socket (if not already open) and consume the
+        banner sent by the pan and tilt on connect
+        """
+        if self.reader is not None:
+            return
+        self.logger.info("Opening connection to %s:%d" % (self.host, self.port))
+        host, port = self._address()
+        self.reader = ptprotocol.FrameReader.connect(host, port, self.timeout)
+        sock = self.reader.sock
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.settimeout(1)
+        try:
+            self.logger.debug(self.reader.read_until(self.cursor+self.sentinel))
+        except socket.timeout:
+            # No banner, nothing to consume
+            pass
+        finally:
+            sock.settimeout(self.timeout)
+
+    def close(self):
+        """
+        Close the socket. The ssh tunnel, if any, is left running
+        so that the next `open` is cheap
+        """
+        if self.reader is not None:
+            try:
+                self.reader.close()
+            except socket.error as ex:
+                self.logger.error("Error closing connection: "+str(ex))
+        self.reader = None
+
+    def _roundTrip(self, command, payload, count):
+        self.open()
+        sent = time.time()
+        self.reader.write(payload)
+        if self.journal is None:
+            return b"".join(self.reader.read_frame() for _ in range(count))
+        replies = []
+        try:
+            for _ in range(count):
+                replies.append(self.reader.read_frame())
+        except Exception:
+            self.journal.record(command, b"".join(replies), sent, time.time(), ptjournal.FAILED)
+            raise
+        output = b"".join(replies)
+        self.journal.record(command, output, sent, time.time())
+        return output
+
+    def execute(self, command):
+        """
+        Send the command(s) to the pan and tilt and read back the replies
+
+        Parameters
+        ----------
+        command : str or bytes
+            one or more whitespace separated commands
+
+        Returns
+        -------
+        output : bytes
+            reply lines, one per command
+
+        Raises
+        ------
+        IOError
+            if the connection fails twice, or once while sending
+            a command that is not idempotent
+        """
+        if not isinstance(command, bytes):
+            command = command.encode("ascii")
+        commands = command.split()
+        if not commands:
+            return b""
+        payload = b"".join(c+self.sentinel for c in commands)
+        with self._lock:
+            start = _clock()
+            try:
+                output = self._roundTrip(command, payload, len(commands))
+            except (IOError, EOFError, socket.error) as ex:
+                self.logger.warning("Connection lost (%s), reconnecting" % str(ex))
+                if isinstance(ex, socket.timeout):
+                    self.metrics.inc("pt_timeouts_total", kind="reply")
+                self.metrics.inc("pt_reconnects_total")
+                self.close()
+                if not all(ptprotocol.is_idempotent(c) for c in commands):
+                    raise IOError("Not resending %s after failure: %s" % (command, str(ex)))
+                self.metrics.inc("pt_retries_total")
+                try:
+                    output = self._roundTrip(command, payload, len(commands))
+                except EOFError as ex:
+                    self.close()
+                    raise IOError(str(ex))
+            if self.metrics.enabled:
+                self.metrics.observe("pt_command_seconds", _clock() - start,
+                                     command=ptmetrics.command_type(commands[0]))
+            return output
+
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+def get_connection(host, port, via=None, timeout=5, journal=None):
+    """
+    Returns the shared connection for the pan and tilt at `host`:`port`,
+    creating it on first use
+
+    Parameters
+    ----------
+    host : str
+        ip address of the pan and tilt
+    port : int
+        port number of the pan and tilt
+    via : str, optional
+        ssh host to tunnel through
+    timeout : float, optional
+        socket timeout in seconds
+    journal : ptjournal.Journal, optional
+        where the connection records every exchange
+
+    Returns
+    -------
+    connection : PTConnection
+
+    Raises
+    ------
+    ValueError
+        if the shared connection already exists with another
+        `timeout` or `journal`
+    """
+    key = (host, int(port), via)
+    with _pool_lock:
+        connection = _pool.get(key)
+        if connection is None:
+            connection = _pool[key] = PTConnection(host, port, via=via, timeout=timeout,
+                                                   journal=journal)
+        elif connection.timeout != timeout or (journal is not None and
+                                               journal is not connection.journal):
+            raise ValueError("Connection to %s:%s already open with timeout=%s journal=%r" % (
+                host, port, connection.timeout, connection.journal))
+        return connection
+
+
+def close_all():
+    """
+    Close every pooled connection and ssh tunnel
+    """
+    with _pool_lock:
+        for connection in _pool.values():
+            connection.close()
+            if connection.tunnel:
+                connection.tunnel.close()
+        _pool.clear()
+
+
+atexit.register(close_all)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module defines a single sender for every command to a pan and
+tilt, with priority lanes so that an emergency stop never queues
+behind motion.
+
+Lanes, served in this order:
+
+- HALT: `H`. Submitting it drops any pending motion
+- CONTROL: commands whose reply is needed (queries, presets, setup)
+- MOTION: latest-value-wins targets, rate limited. A burst of motion
+  updates (e.g. joystick axis events) collapses into the freshest
+  target per axis instead of a stale backlog. Speeds are sent ahead
+  of the positions they govern
+"""
+
+import collections
+import threading
+import time
+from collections import OrderedDict
+from pyflirpt.utils import ptlogger, ptmetrics
+
+# Lanes, highest priority first
+HALT = 0
+CONTROL = 1
+MOTION = 2
+# Motion keys sent first in a merged send, as they only apply to
+# the position commands that follow them
+SPEED_KEYS = ("PS", "TS")
+
+
+def command_key(command):
+    """
+    Returns the key under which a motion command is coalesced:
+    the alphabetic prefix (`PP`, `TP`, `PS`, `TS`, ...) for
+    commands carrying a value, the command itself otherwise
+    """
+    prefix = command.rstrip("-0123456789")
+    return prefix if prefix != command else command
+
+
+class Ticket(object):
+    """
+    Handle on a dispatched command. The sender thread fills in
+    the reply (or the error) once the command has been sent
+    """
+    __slots__ = ("commands", "lane", "submitted", "reply", "error", "_done")
+
+    def __init__(self, commands, lane):
+        self.commands = commands
+        self.lane = lane
+        self.submitted = time.time()
+        self.reply = None
+        self.error = None
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the reply
+
+        Raises
+        ------
+        IOError
+            if no reply came within `timeout` seconds
+        Exception
+            whatever sending the command raised
+        """
+        if not self._done.wait(timeout):
+            raise IOError("No reply to %s within %s s" % (self.commands, timeout))
+        if self.error is not None:
+            raise self.error
+        return self.reply
+
+
+class CommandDispatcher(object):
+    """
+    Queue of commands drained by one sender thread, highest
+    priority lane first
+
+    Parameters
+    ----------
+    send : callable
+        called from the sender thread with whitespace separated
+        commands, returns the replies, e.g. `PTConnection.execute`
+    max_rate : float, optional
+        maximum number of motion sends per second (default: 40)
+    metrics : ptmetrics.Registry, optional
+        where to record queue depth, suppressed motion and halt latency
+    """
+    def __init__(self, send, max_rate=40, metrics=None):
+        self.logger = ptlogger.ptlogger(tofile=True)
+        self.metrics = metrics if metrics is not None else ptmetrics.registry
+        self.send = send
+        self.period = 1.0 / max_rate
+        self.superseded = 0
+        self._halts = collections.deque()
+        self._control = collections.deque()
+        self._motion = OrderedDict()
+        self._motion_ticket = None
+        self._next_motion = 0
+        self._busy = False
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="CommandDispatcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _depth(self):
+        return len(self._halts) + len(self._control) + len(self._motion)
+
+    def halt(self):
+        """
+        Stop both axes: pending motion is dropped and `H` is
+        the next command sent
+
+        Returns
+        -------
+        ticket : Ticket
+        """
+        ticket = Ticket("H", HALT)
+        with self._cond:
+            if self._motion:
+                self.superseded += len(self._motion)
+                self.metrics.inc("pt_suppressed_total", len(self._motion), command="halt")
+                self._motion.clear()
+                self._motion_ticket.error = IOError("Motion dropped by halt")
+                self._motion_ticket._done.set()
+                self._motion_ticket = None
+            self._halts.append(ticket)
+            self.metrics.set("pt_queue_depth", self._depth(), queue="dispatcher")
+            self._cond.notify_all()
+        return ticket
+
+    def request(self, commands):
+        """
+        Queue commands whose reply is needed
+
+        Parameters
+        ----------
+        commands : str
+            one or more whitespace separated commands
+
+        Returns
+        -------
+        ticket : Ticket
+        """
+        ticket = Ticket(commands, CONTROL)
+        with self._cond:
+            self._control.append(ticket)
+            self.metrics.set("pt_queue_depth", self._depth(), queue="dispatcher")
+            self._cond.notify_all()
+        return ticket
+
+    def move(self, commands):
+        """
+        Queue motion, replacing any pending command with the same key
+
+        Parameters
+        ----------
+        commands : list of str
+            each entry may hold several whitespace separated commands
+
+        Returns
+        -------
+        ticket : Ticket
+            shared by all motion merged into the same send
+        """
+        with self._cond:
+            for entry in commands:
+                for command in entry.split():
+                    key = command_key(command)
+                    if key in self._motion:
+                        self.superseded += 1
+                        self.metrics.inc("pt_suppressed_total", command=key)
+                        # Move to the end, in the order of the latest submission
+                        del self._motion[key]
+                    self._motion[key] = command
+            if self._motion_ticket is None:
+                self._motion_ticket = Ticket(None, MOTION)
+            ticket = self._motion_ticket
+            self.metrics.set("pt_queue_depth", self._depth(), queue="dispatcher")
+            self._cond.notify_all()
+        return ticket
+
+    def pending(self):
+        """
+        Returns the number of commands waiting to be sent
+        """
+        with self._cond:
+            return self._depth()
+
+    def flush(self, timeout=None):
+        """
+        Block until every queued command has been sent
+
+        Returns
+        -------
+        flushed : bool
+            False if `timeout` expired first
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._depth() or self._busy:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self):
+        """
+        Send whatever is pending and stop the sender thread
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _take(self):
+        """
+        Next ticket to send, None once stopped and drained.
+        Called with the condition held
+        """
+        while True:
+            if self._halts:
+                return self._halts.popleft()
+            if self._control:
+                return self._control.popleft()
+            if self._motion:
+                wait = self._next_motion - time.time()
+                if wait <= 0 or self._stopped:
+                    ticket = self._motion_ticket
+                    speeds = [key for key in self._motion if key in SPEED_KEYS]
+                    others = [key for key in self._motion if key not in SPEED_KEYS]
+                    ticket.commands = " ".join(self._motion[key] for key in speeds + others)
+                    self._motion.clear()
+                    self._motion_ticket = None
+                    return ticket
+                # Let motion pile up (and get merged) until its slot
+                self._cond.wait(wait)
+                continue
+            if self._stopped:
+                return None
+            self._cond.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                ticket = self._take()
+                if ticket is None:
+                    return
+                self._busy = True
+                self.metrics.set("pt_queue_depth", self._depth(), queue="dispatcher")
+            if ticket.lane == HALT:
+                self.metrics.observe("pt_halt_wait_seconds", time.time() - ticket.submitted)
+            try:
+                ticket.reply = self.send(ticket.commands)
+            except Exception as ex:
+                self.logger.error("Error sending %s: %s" % (ticket.commands, str(ex)))
+                ticket.error = ex
+            ticket._done.set()
+            with self._cond:
+                if ticket.lane == MOTION:
+                    self._next_motion = time.time() + self.period
+                self._busy = False
+                self._cond.notify_all()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module defines an append-only binary journal of every command
+sent to a pan and tilt, with its raw reply and the times at which
+it was sent and the reply received, and a tool replaying a journal
+against a pan and tilt (by default a local simulator) to compare
+latencies.
+
+A journal starts with `MAGIC`, followed by one record per exchange:
+a little endian "<ddBHI" header (send time, receive time, flags,
+command length, reply length) then the command and reply bytes.
+Records go through a buffered file, so journaling costs a struct
+pack and a memory copy per command.
+
+Replay a journal against a simulator with the same latency:
+
+    python -m pyflirpt.utils.ptjournal keyboard.journal --latency 0.002
+"""
+
+import argparse
+import atexit
+import struct
+import threading
+import time
+from collections import namedtuple
+from pyflirpt.utils import ptlogger, ptprotocol
+
+MAGIC = b"PTJ1"
+_RECORD = struct.Struct("<ddBHI")
+# Record flags
+FAILED = 1
+# Sent without waiting for the reply, acknowledged later
+NOWAIT = 2
+
+Entry = namedtuple("Entry", "sent received flags command reply")
+
+
+class Journal(object):
+    """
+    Buffered append-only writer of command journal records
+
+    Parameters
+    ----------
+    path : str
+        journal file, appended to
+    buffering : int, optional
+        bytes buffered before a write to the file (default: 64 KiB)
+    flush_interval : float, optional
+        a record made this many seconds after the last flush flushes
+        the buffer, so a crash loses at most that much (default: 1)
+    """
+    def __init__(self, path, buffering=65536, flush_interval=1.0):
+        self.logger = ptlogger.ptlogger(tofile=True)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "ab", buffering)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._flushed = time.time()
+        atexit.register(self.close)
+
+    def record(self, command, reply, sent, received, flags=0):
+        """
+        Append one exchange
+
+        Parameters
+        ----------
+        command : bytes
+            command(s) as sent, without framing
+        reply : bytes
+            raw reply, empty if none was read
+        sent, received : float
+            time.time() at which the command was written and its
+            reply read
+        flags : int, optional
+            FAILED and/or NOWAIT
+        """
+        reply = reply or b""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(_RECORD.pack(sent, received, flags, len(command), len(reply)))
+            self._file.write(command)
+            self._file.write(reply)
+            self.records += 1
+            if received - self._flushed > self.flush_interval:
+                self._file.flush()
+                self._flushed = received
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                self._flushed = time.time()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def read_journal(path):
+    """
+    Iterate over the records of a journal. A record cut short by a
+    crash ends the iteration
+
+    Yields
+    ------
+    entry : Entry
+        (sent, received, flags, command, reply)
+    """
+    with open(path, "rb") as j_handler:
+        if j_handler.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a command journal" % path)
+        while True:
+            header = j_handler.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            sent, received, flags, command_len, reply_len = _RECORD.unpack(header)
+            command = j_handler.read(command_len)
+            reply = j_handler.read(reply_len)
+            if len(reply) < reply_len:
+                return
+            yield Entry(sent, received, flags, command, reply)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def replay(entries, host, port, paced=True, timeout=5):
+    """
+    Send the journaled commands again and time the replies
+
+    Parameters
+    ----------
+    entries : iterable of Entry
+        e.g. `read_journal(path)`. Failed exchanges are skipped
+    host, port :
+        pan and tilt (or simulator) to replay against
+    paced : bool, optional
+        keep the original gaps between commands (default: True),
+        otherwise send them back to back
+
+    Returns
+    -------
+    results : list of (Entry, replayed latency)
+        latency is None for commands sent without waiting
+    """
+    conn = ptprotocol.FrameReader.connect(host, port, timeout)
+    results = []
+    try:
+        conn.read_until(b"*\r\n")
+        unread = 0
+        first = start = None
+        for entry in entries:
+            if entry.flags & FAILED:
+                continue
+            if first is None:
+                first, start = entry.sent, time.time()
+            elif paced:
+                delay = start + entry.sent - first - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            commands = entry.command.split()
+            for i in range(unread):
+                conn.read_frame()
+            sent = time.time()
+            conn.write(b"".join(command+b"\r\n" for command in commands))
+            if entry.flags & NOWAIT:
+                unread = len(commands)
+                results.append((entry, None))
+                continue
+            unread = 0
+            for command in commands:
+                conn.read_frame()
+            results.append((entry, time.time() - sent))
+    finally:
+        conn.close()
+    return results
+
+
+def compare(results, slowest=5):
+    """
+    Print recorded against replayed latency percentiles per command
+    type (the types of every command of a batched exchange), and the
+    exchanges that were slowest when recorded
+    """
+    timed = [(entry, latency) for entry, latency in results if latency is not None]
+    if not timed:
+        print("Nothing to compare")
+        return
+    groups = {}
+    for entry, latency in timed:
+        kind = tuple(command.rstrip(b"-0123456789") for command in entry.command.split())
+        groups.setdefault(kind, []).append((entry.received - entry.sent, latency))
+    print("%-16s %6s   %-25s %-25s" % ("command", "count", "recorded p50/p99 ms", "replayed p50/p99 ms"))
+    for kind, pairs in sorted(groups.items()):
+        recorded = [pair[0] for pair in pairs]
+        replayed = [pair[1] for pair in pairs]
+        print("%-16s %6d   %8.2f / %-14.2f %8.2f / %-14.2f" % (
+            b" ".join(kind).decode("ascii", "replace"), len(pairs),
+            percentile(recorded, 50) * 1e3, percentile(recorded, 99) * 1e3,
+            percentile(replayed, 50) * 1e3, percentile(replayed, 99) * 1e3))
+    print("Slowest recorded exchanges:")
+    for entry, latency in sorted(timed, key=lambda pair: pair[0].sent - pair[0].received)[:slowest]:
+        print("  %.3f %-30s recorded %8.2f ms   replayed %8.2f ms" % (
+            entry.sent, repr(entry.command.decode("ascii", "replace")),
+            (entry.received - entry.sent) * 1e3, latency * 1e3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a pan and tilt command journal")
+    parser.add_argument("journal")
+    parser.add_argument("--host", help="pan and tilt to replay against (default: local simulator)")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--latency", type=float, default=0, help="simulator seconds per reply packet")
+    parser.add_argument("--jitter", type=float, default=0, help="simulator max extra seconds per reply packet")
+    parser.add_argument("--fast", action="store_true", help="send commands back to back")
+    args = parser.parse_args()
+    sim = None
+    host, port = args.host, args.port
+    if host is None:
+        from pyflirpt.utils import ptsimulator
+        sim = ptsimulator.PTSimulator(latency=args.latency, jitter=args.jitter)
+        sim.start()
+        host, port = sim.host, sim.port
+    try:
+        compare(replay(read_journal(args.journal), host, port, paced=not args.fast))
+    finally:
+        if sim is not None:
+            sim.stop()
+
+
+if __name__ == "__main__":
+    main()
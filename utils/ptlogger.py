@@ -5,22 +5,104 @@ This modules defines ptlogger function which
 implements a flexible event logging system.
 """
 
+import atexit
 import logging
 import logging.handlers
 import os
-import inspect
+import sys
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
-def ptlogger(loggername=None, every="midnight", tofile=False):
+# Handlers already attached, per logger name
+_configured = {}
+# QueueListeners of the loggers in asynchronous mode
+_listeners = {}
+_lock = threading.Lock()
+# QueueHandler and QueueListener are Python 3 only, asynchronous
+# mode falls back to the plain synchronous handlers without them
+ASYNC_SUPPORTED = (hasattr(logging.handlers, "QueueHandler") and
+                   hasattr(logging.handlers, "QueueListener"))
+
+if ASYNC_SUPPORTED:
+    class BoundedQueueHandler(logging.handlers.QueueHandler):
+        """
+        QueueHandler that never lets the caller wait on a full queue
+        unless asked to
+
+        Parameters
+        ----------
+        maxsize : int
+            maximum number of records waiting to be written
+        overflow : str {'drop_newest', 'drop_oldest', 'block'}
+            what to do with a record when the queue is full
+        """
+        def __init__(self, maxsize=10000, overflow="drop_newest"):
+            if overflow not in ("drop_newest", "drop_oldest", "block"):
+                raise ValueError("Unknown overflow policy: "+str(overflow))
+            logging.handlers.QueueHandler.__init__(self, queue.Queue(maxsize))
+            self.overflow = overflow
+            self.dropped = 0
+
+        def prepare(self, record):
+            # The listener lives in this process, so the record can be
+            # handed over as is and formatted off the caller's thread
+            return record
+
+        def enqueue(self, record):
+            if self.overflow == "block":
+                self.queue.put(record)
+                return
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow == "drop_oldest":
+                    try:
+                        self.queue.get_nowait()
+                        self.queue.put_nowait(record)
+                    except (queue.Empty, queue.Full):
+                        pass
+
+
+def _stop_listeners():
+    with _lock:
+        for listener in _listeners.values():
+            listener.stop()
+        _listeners.clear()
+
+
+atexit.register(_stop_listeners)
+
+
+def ptlogger(loggername=None, every="midnight", tofile=False,
+             asynchronous=False, maxsize=10000, overflow="drop_newest"):
     """
     This function will return a logger that will write the
-    debug level logs to a file and print info level 
+    debug level logs to a file and print info level
     logs on the screen
 
+    Calling it again for the same logger does not add
+    duplicate handlers. The mode chosen by the first call
+    for a logger (synchronous or not) is kept
+
     Parameters
     ----------
+    loggername : str, optional
+        Name of the logger (the default is the caller's module file name)
     every : str, optional {'S', 'M', 'H', 'D', 'midnight'}
         Backup of logs `every` (the default is `midnight`)
-    tofile: bool, Write logs to file or not  
+    tofile: bool, Write logs to file or not
+    asynchronous : bool, optional
+        Hand records to a background thread through a bounded queue
+        so that logging never waits on disk or terminal I/O
+        (the default is False)
+    maxsize : int, optional
+        Size of the queue in asynchronous mode (the default is 10000)
+    overflow : str, optional {'drop_newest', 'drop_oldest', 'block'}
+        What to do when the queue is full (the default is `drop_newest`)
 
     Returns
     -------
@@ -29,28 +111,54 @@ def ptlogger(loggername=None, every="midnight", tofile=False):
     """
     #BASE_DIR = os.getenv('pantilt_logs')
     BASE_DIR = "/var/log/cuic/"
-    loggername=str(inspect.getouterframes(inspect.currentframe())[1][1]).split('/')[-1][:-3]
+    if not ASYNC_SUPPORTED:
+        asynchronous = False
+    if loggername is None:
+        loggername = os.path.splitext(os.path.basename(sys._getframe(1).f_code.co_filename))[0]
     LOG_FNAME = os.path.join(BASE_DIR, loggername)
     logger = logging.getLogger(loggername)
 
-    logger.setLevel(logging.INFO)
-    formatter = logging.Formatter(
-        "[%(asctime)s] - [%(levelname)8s] --- %(message)s (%(filename)s:%(lineno)s)\n \033[F", datefmt="%d-%m-%Y %H:%M:%S")
-
-    # Setup TimedRotatingFileHandler
-    f_handler = logging.handlers.RotatingFileHandler(
-        LOG_FNAME, mode='a', maxBytes=1*1024*1024, backupCount=2)
-    f_handler.suffix = "%b-%d-%Y %H:%M:%S.log"
-    f_handler.setFormatter(formatter)
-
-    # Setup StreamHandler
-    s_handler = logging.StreamHandler()
-    s_handler.setLevel(logging.INFO)
-    s_handler.setFormatter(formatter)
-
-    # Add handlers to the module
-    logger.addHandler(s_handler)
-    if tofile:
-        logger.addHandler(f_handler)
+    with _lock:
+        kinds = _configured.setdefault(loggername, set())
+        if "stream" in kinds and ("file" in kinds or not tofile):
+            return logger
+
+        logger.setLevel(logging.INFO)
+        formatter = logging.Formatter(
+            "[%(asctime)s] - [%(levelname)8s] --- %(message)s (%(filename)s:%(lineno)s)\n \033[F", datefmt="%d-%m-%Y %H:%M:%S")
+
+        handlers = []
+        if "stream" not in kinds:
+            # Setup StreamHandler
+            s_handler = logging.StreamHandler()
+            s_handler.setLevel(logging.INFO)
+            s_handler.setFormatter(formatter)
+            handlers.append(s_handler)
+            kinds.add("stream")
+        if tofile and "file" not in kinds:
+            # Setup TimedRotatingFileHandler
+            f_handler = logging.handlers.RotatingFileHandler(
+                LOG_FNAME, mode='a', maxBytes=1*1024*1024, backupCount=2)
+            f_handler.suffix = "%b-%d-%Y %H:%M:%S.log"
+            f_handler.setFormatter(formatter)
+            handlers.append(f_handler)
+            kinds.add("file")
+
+        listener = _listeners.get(loggername)
+        if asynchronous and listener is None and not logger.handlers:
+            q_handler = BoundedQueueHandler(maxsize, overflow)
+            listener = logging.handlers.QueueListener(
+                q_handler.queue, *handlers, respect_handler_level=True)
+            listener.start()
+            _listeners[loggername] = listener
+            logger.addHandler(q_handler)
+        elif listener is not None:
+            # Already asynchronous, new handlers go behind the queue
+            listener.stop()
+            listener.handlers = listener.handlers + tuple(handlers)
+            listener.start()
+        else:
+            for handler in handlers:
+                logger.addHandler(handler)
 
     return logger
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module defines a lightweight metrics registry for the
+pan and tilt command paths: latency histograms, counters and
+gauges, exportable as a Prometheus text snapshot or JSON.
+
+The module level `registry` is disabled by default, in which case
+every recording call returns right away. Enable it with::
+
+    from pyflirpt.utils import ptmetrics
+    ptmetrics.registry.enable()
+    ...
+    print(ptmetrics.registry.to_prometheus())
+"""
+
+import bisect
+import json
+import threading
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def command_type(command):
+    """
+    Returns the alphabetic prefix of a command (`PP` for `PP100`)
+    used to label per command metrics
+    """
+    if isinstance(command, bytes):
+        command = command.decode("ascii", "replace")
+    command = command.strip()
+    return command.rstrip("-0123456789") or command
+
+
+class Histogram(object):
+    """
+    Cumulative histogram over fixed buckets
+    """
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Returns [(upper bound, count of values <= bound)], ending with +Inf
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the `q` quantile
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float("inf")
+
+
+class Registry(object):
+    """
+    Collection of counters, gauges and histograms keyed by
+    name and labels
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        record values (default: False)
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def inc(self, name, value=1, **labels):
+        """
+        Add `value` to a counter
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        Set a gauge, e.g. a queue depth
+        """
+        if not self.enabled:
+            return
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Record a value, e.g. a latency in seconds, in a histogram
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def _labels(self, labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (k, v) for k, v in labels)
+
+    def to_prometheus(self):
+        """
+        Returns a snapshot in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+                typed = set()
+                for (name, labels), value in sorted(metrics.items()):
+                    if name not in typed:
+                        lines.append("# TYPE %s %s" % (name, kind))
+                        typed.add(name)
+                    lines.append("%s%s %s" % (name, self._labels(labels), value))
+            typed = set()
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append("# TYPE %s histogram" % name)
+                    typed.add(name)
+                for bound, total in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append("%s_bucket%s %d" % (name, self._labels(labels, (("le", le),)), total))
+                lines.append("%s_sum%s %r" % (name, self._labels(labels), histogram.sum))
+                lines.append("%s_count%s %d" % (name, self._labels(labels), histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        Returns the metrics as plain dicts and lists
+        """
+        with self._lock:
+            return {
+                "counters": [dict(name=name, labels=dict(labels), value=value)
+                             for (name, labels), value in sorted(self.counters.items())],
+                "gauges": [dict(name=name, labels=dict(labels), value=value)
+                           for (name, labels), value in sorted(self.gauges.items())],
+                "histograms": [dict(name=name, labels=dict(labels),
+                                    count=h.count, sum=h.sum,
+                                    p50=h.quantile(0.5), p99=h.quantile(0.99),
+                                    buckets=[[b if b != float("inf") else "+Inf", n]
+                                             for b, n in h.cumulative()])
+                               for (name, labels), h in sorted(self.histograms.items())],
+            }
+
+    def to_json(self, **kwargs):
+        """
+        Returns the snapshot as a JSON string
+        """
+        return json.dumps(self.snapshot(), **kwargs)
+
+
+# Registry used by the controllers
+registry = Registry()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module defines an in-memory store of pan and tilt presets
+backed by a CSV file (`key,"pan,tilt"` rows, the last row of a
+key wins).
+
+Presets are read once. Recalls are dict lookups, and changes are
+appended to the file by a single background writer, which compacts
+it (one row per key, written to a temporary file and renamed over
+the original) once it holds too many stale rows.
+"""
+
+import atexit
+import os
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from pyflirpt.utils import ptlogger
+
+# Queue marker asking the writer to compact and exit
+_STOP = object()
+
+
+class PresetStore(object):
+    """
+    Presets keyed by name (e.g. the joystick button number)
+
+    Parameters
+    ----------
+    path : str
+        CSV file holding the presets. Created on the first change
+    compact_ratio : float, optional
+        compact the file once it holds more than `compact_ratio`
+        rows per preset (default: 2)
+    """
+    def __init__(self, path, compact_ratio=2):
+        self.logger = ptlogger.ptlogger(tofile=True)
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self._presets = {}
+        self._rows = 0
+        self._lock = threading.Lock()
+        self._load()
+        # Before the writer starts, so no change can race the rewrite
+        try:
+            if self._rows > len(self._presets):
+                self._compact()
+        except (IOError, OSError) as ex:
+            self.logger.error("Error compacting presets: "+str(ex))
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="PresetWriter")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as p_handler:
+                for lineno, line in enumerate(p_handler, 1):
+                    if not line.strip():
+                        continue
+                    self._rows += 1
+                    try:
+                        key, value = line.strip().split(",", 1)
+                        pan, tilt = value.strip('"').split(",")
+                        self._presets[key] = (int(pan), int(tilt))
+                    except ValueError:
+                        self.logger.warning("%s:%d: cannot parse preset %r" % (
+                            self.path, lineno, line.strip()))
+        except IOError:
+            # No presets saved yet
+            pass
+
+    def get(self, key):
+        """
+        Returns the (pan, tilt) preset for `key`, None if not set
+        """
+        return self._presets.get(str(key))
+
+    def set(self, key, pan, tilt):
+        """
+        Store a preset. The file is updated in the background
+        """
+        key = str(key)
+        with self._lock:
+            self._presets[key] = (int(pan), int(tilt))
+        self._queue.put((key, int(pan), int(tilt)))
+
+    def keys(self):
+        return list(self._presets.keys())
+
+    def __contains__(self, key):
+        return str(key) in self._presets
+
+    def __len__(self):
+        return len(self._presets)
+
+    def _row(self, key, pan, tilt):
+        return '%s,"%d,%d"\r\n' % (key, pan, tilt)
+
+    def _append(self, changes):
+        with open(self.path, "a") as p_handler:
+            p_handler.write("".join(self._row(*change) for change in changes))
+            p_handler.flush()
+            os.fsync(p_handler.fileno())
+        self._rows += len(changes)
+
+    def _compact(self):
+        """
+        Rewrite the file with one row per preset
+        """
+        with self._lock:
+            presets = sorted(self._presets.items())
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as p_handler:
+            p_handler.write("".join(self._row(key, pan, tilt) for key, (pan, tilt) in presets))
+            p_handler.flush()
+            os.fsync(p_handler.fileno())
+        os.rename(tmp, self.path)
+        self._rows = len(presets)
+
+    def _needsCompaction(self):
+        return self._rows > self.compact_ratio * max(len(self._presets), 1)
+
+    def _run(self):
+        while True:
+            changes = [self._queue.get()]
+            # Write everything queued so far in one go
+            while True:
+                try:
+                    changes.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # One task_done per item taken off the queue
+            received = len(changes)
+            stop = _STOP in changes
+            try:
+                changes = [change for change in changes if change is not _STOP]
+                if changes:
+                    self._append(changes)
+                if self._needsCompaction() or (stop and self._rows > len(self._presets)):
+                    self._compact()
+            except (IOError, OSError) as ex:
+                self.logger.error("Error saving presets: "+str(ex))
+            finally:
+                for i in range(received):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """
+        Block until every change has been written
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Write pending changes, compact the file and stop the writer
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
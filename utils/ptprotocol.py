@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module defines the framing and reply parsing of the pan and
+tilt protocol: every command gets one reply line terminated by
+`\\r\\n`, starting with `*` on success or `!` on error, e.g.
+
+    * Current Pan position is -332\\r\\n
+    ! Illegal argument\\r\\n
+
+Anything else in the stream (echoed commands, the connect banner)
+is not a reply and is skipped by the parsing helpers.
+
+`FrameReader` reads lines straight off a socket into a reusable
+buffer, so that high rate status polling does not allocate or rescan.
+It returns every line, replies or not.
+"""
+
+import re
+import socket
+from pyflirpt.utils import ptmetrics
+
+_FRAME = re.compile(br"([*!])([^\r\n]*)\r\n")
+_INT = re.compile(br"(-?\d+)\s*$")
+_STATUS = re.compile(br"P\((-?\d+),(-?\d+)\)\s*S\((-?\d+),(-?\d+)\)")
+
+# Commands that leave the module in the same state however many
+# times they run, and so are safe to send again after a failure
+IDEMPOTENT_COMMANDS = frozenset(["B", "PP", "TP", "PS", "TS", "ED", "EE",
+                                 "CI", "LU", "LE", "LD", "H"])
+
+
+class PTError(IOError):
+    """
+    Raised when the pan and tilt answers a command with `!`
+    """
+    def __init__(self, message, reply=None):
+        IOError.__init__(self, message)
+        self.reply = reply
+
+
+def is_idempotent(command):
+    """
+    Returns True if `command` can be resent blindly after a
+    failure: status queries, absolute positions and speeds,
+    mode settings and halt
+    """
+    return ptmetrics.command_type(command) in IDEMPOTENT_COMMANDS
+
+
+def _bytes(data):
+    if not isinstance(data, bytes):
+        data = data.encode("ascii")
+    return data
+
+
+def split_replies(data):
+    """
+    Split raw output into reply frames
+
+    Parameters
+    ----------
+    data : bytes
+        output of one or more commands
+
+    Returns
+    -------
+    replies : list of (ok, text)
+        one entry per complete frame, `ok` False for `!` replies
+    """
+    return [(mark == b"*", text.strip()) for mark, text in _FRAME.findall(_bytes(data))]
+
+
+def replies(data, count=None):
+    """
+    Returns the text of every reply
+
+    Parameters
+    ----------
+    data : bytes
+        output of one or more commands
+    count : int, optional
+        number of replies expected
+
+    Raises
+    ------
+    PTError
+        on an error reply or when fewer than `count` replies are found
+    """
+    frames = split_replies(data)
+    for ok, text in frames:
+        if not ok:
+            raise PTError(text.decode("ascii", "replace"), data)
+    if count is not None and len(frames) < count:
+        raise PTError("Expected %d replies, got %d" % (count, len(frames)), data)
+    return [text for ok, text in frames]
+
+
+def query_values(data, count=None):
+    """
+    Returns the number ending every reply, e.g. of `PP TP` queries
+
+    Raises
+    ------
+    PTError
+        on an error reply, a reply without a number, or when fewer
+        than `count` replies are found
+    """
+    values = []
+    for text in replies(data, count):
+        match = _INT.search(text)
+        if match is None:
+            raise PTError("No value in reply %r" % text, data)
+        values.append(int(match.group(1)))
+    return values
+
+
+def parse_status(reply):
+    """
+    Parse the reply of a `B` query, e.g. `* P(100,-200) S(0,0)`
+
+    Returns
+    -------
+    (pan, tilt, pan_speed, tilt_speed) : tuple of int
+
+    Raises
+    ------
+    PTError
+        if the reply is not a status
+    """
+    match = _STATUS.search(reply)
+    if match is None:
+        raise PTError("Not a status reply: %r" % (reply,), reply)
+    pan, tilt, pan_speed, tilt_speed = match.groups()
+    return int(pan), int(tilt), int(pan_speed), int(tilt_speed)
+
+
+class FrameReader(object):
+    """
+    Buffered reader of `\\r\\n` terminated replies on a socket
+
+    Data is received with `recv_into` into one `bytearray` that is
+    reused for the life of the connection. The search for the end
+    of a frame resumes where the previous one stopped, so a reply
+    arriving in several packets is scanned only once.
+
+    Parameters
+    ----------
+    sock : socket
+        connected socket. Its timeout applies to every read
+    bufsize : int, optional
+        initial buffer size, grown when a frame does not fit
+    """
+    sentinel = b"\r\n"
+
+    def __init__(self, sock, bufsize=4096):
+        self.sock = sock
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        # Unread data is _buf[_start:_end], no sentinel in _buf[_start:_scan]
+        self._start = 0
+        self._end = 0
+        self._scan = 0
+
+    @classmethod
+    def connect(cls, host, port, timeout=None):
+        """
+        Open a TCP connection and return its reader
+        """
+        sock = socket.create_connection((host, int(port)), timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(sock)
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def pending(self):
+        """
+        Returns the number of bytes received but not read yet
+        """
+        return self._end - self._start
+
+    def _makeRoom(self):
+        size = self._end - self._start
+        if self._start:
+            # Move the partial frame to the front
+            self._buf[:size] = self._view[self._start:self._end].tobytes()
+        else:
+            # The buffer cannot grow while a view of it exists
+            if hasattr(self._view, "release"):
+                self._view.release()
+            self._view = None
+            self._buf.extend(bytearray(len(self._buf)))
+            self._view = memoryview(self._buf)
+        self._scan -= self._start
+        self._start = 0
+        self._end = size
+
+    def read_frame(self):
+        """
+        Returns the next frame, sentinel included
+
+        Raises
+        ------
+        socket.timeout
+            if the socket timeout expires first
+        EOFError
+            if the connection is closed
+        """
+        while True:
+            end = self._buf.find(self.sentinel, self._scan, self._end)
+            if end >= 0:
+                end += 2
+                frame = self._view[self._start:end].tobytes()
+                if end == self._end:
+                    self._start = self._end = self._scan = 0
+                else:
+                    self._start = self._scan = end
+                return frame
+            # The sentinel may straddle the next packet
+            self._scan = max(self._start, self._end - 1)
+            if self._end == len(self._buf):
+                self._makeRoom()
+            received = self.sock.recv_into(self._view[self._end:])
+            if not received:
+                raise EOFError("Connection closed by pan and tilt")
+            self._end += received
+
+    def read_until(self, end):
+        """
+        Read and return every frame up to and including the first
+        one ending with `end`, e.g. the `*\\r\\n` ending the
+        connect banner, which may follow other text on its line
+        """
+        frames = []
+        while True:
+            frames.append(self.read_frame())
+            if frames[-1].endswith(end):
+                return b"".join(frames)
+
+    def close(self):
+        try:
+            self.sock.close()
+        finally:
+            self._start = self._end = self._scan = 0
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module defines a fake pan and tilt server which speaks
+enough of the FLIR PTU protocol to exercise the controllers
+without the hardware: `B`, `PP`/`TP`, `PS`/`TS`, `ED`, `CI`,
+`LU`, `H`, with `*` replies framed by `\\r\\n`.
+
+Axes slew towards their target at the configured speed, and every
+reply can be delayed by a configurable network latency and jitter.
+
+Run it standalone with::
+
+    python -m pyflirpt.utils.ptsimulator --port 4000 --latency 0.005
+"""
+
+import argparse
+import asyncio
+import random
+import threading
+import time
+
+
+class Axis(object):
+    """
+    One simulated axis moving at constant speed towards its target
+
+    Parameters
+    ----------
+    limits : (min, max)
+        allowed positions
+    speed : int
+        positions per second
+    """
+    def __init__(self, limits, speed):
+        self.limits = limits
+        self.speed = speed
+        self._start = 0
+        self._target = 0
+        self._t0 = time.monotonic()
+
+    def _travelled(self, now):
+        return self.speed * (now - self._t0)
+
+    def position(self, now=None):
+        now = time.monotonic() if now is None else now
+        distance = self._target - self._start
+        travelled = min(self._travelled(now), abs(distance))
+        return int(round(self._start + (travelled if distance >= 0 else -travelled)))
+
+    def moving(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self._travelled(now) < abs(self._target - self._start)
+
+    def current_speed(self, now=None):
+        return self.speed if self.moving(now) else 0
+
+    def _rebase(self, target):
+        now = time.monotonic()
+        self._start = self.position(now)
+        self._target = target
+        self._t0 = now
+
+    def move(self, target):
+        self._rebase(target)
+
+    def set_speed(self, speed):
+        self._rebase(self._target)
+        self.speed = speed
+
+    def halt(self):
+        self._rebase(self.position())
+
+
+class PTSimulator(object):
+    """
+    asyncio TCP server emulating a FLIR E series pan and tilt
+
+    Every whitespace separated command gets one reply line,
+    `*` followed by optional text and `\\r\\n` on success or
+    `!` followed by the error on failure.
+
+    Parameters
+    ----------
+    host : str, optional
+        address to listen on (default: 127.0.0.1)
+    port : int, optional
+        port to listen on. 0 picks a free port (default: 0)
+    latency : float, optional
+        seconds added before the replies to every packet (default: 0)
+    jitter : float, optional
+        uniform random extra delay in seconds, 0..`jitter` (default: 0)
+    """
+    banner = b"FLIR PTU simulator\r\n*\r\n"
+    PAN_LIMITS = (-4000, 4000)
+    TILT_LIMITS = (-2100, 2100)
+    MAX_SPEED = 2000
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, jitter=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.pan_axis = Axis(self.PAN_LIMITS, 1000)
+        self.tilt_axis = Axis(self.TILT_LIMITS, 1000)
+        self.commands = 0
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def pan(self):
+        return self.pan_axis.position()
+
+    @property
+    def tilt(self):
+        return self.tilt_axis.position()
+
+    @property
+    def pan_speed(self):
+        return self.pan_axis.speed
+
+    @property
+    def tilt_speed(self):
+        return self.tilt_axis.speed
+
+    def handle(self, command):
+        """
+        Apply a single command and return its reply
+
+        Parameters
+        ----------
+        command : str
+            command without framing
+
+        Returns
+        -------
+        reply : str
+            reply without framing
+        """
+        self.commands += 1
+        command = command.upper()
+        name, arg = command[:2], command[2:]
+        if command == "B":
+            now = time.monotonic()
+            return "* P(%d,%d) S(%d,%d)" % (
+                self.pan_axis.position(now), self.tilt_axis.position(now),
+                self.pan_axis.current_speed(now), self.tilt_axis.current_speed(now))
+        if command == "H":
+            self.pan_axis.halt()
+            self.tilt_axis.halt()
+            return "*"
+        if name in ("ED", "EE", "CI", "LU", "LE", "LD") and not arg:
+            return "*"
+        if name in ("PP", "TP", "PS", "TS"):
+            axis = self.pan_axis if name[0] == "P" else self.tilt_axis
+            label = "Pan" if name[0] == "P" else "Tilt"
+            if not arg:
+                if name[1] == "P":
+                    return "* Current %s position is %d" % (label, axis.position())
+                return "* Current %s speed is %d" % (label, axis.speed)
+            try:
+                value = int(arg)
+            except ValueError:
+                return "! Illegal argument"
+            if name[1] == "P":
+                if not axis.limits[0] <= value <= axis.limits[1]:
+                    return "! %s position out of limits" % label
+                axis.move(value)
+            else:
+                if not 0 < value <= self.MAX_SPEED:
+                    return "! %s speed out of limits" % label
+                axis.set_speed(value)
+            return "*"
+        return "! Illegal command"
+
+    def _delay(self):
+        if self.jitter:
+            return self.latency + random.uniform(0, self.jitter)
+        return self.latency
+
+    async def _client(self, reader, writer):
+        writer.write(self.banner)
+        pending = b""
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                pending += data
+                lines = pending.replace(b"\r", b"\n").split(b"\n")
+                pending = lines.pop()
+                replies = [self.handle(command).encode("ascii") + b"\r\n"
+                           for line in lines
+                           for command in line.decode("ascii", "replace").split()]
+                if not replies:
+                    continue
+                # One network delay per packet, pipelined commands share it
+                delay = self._delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                writer.write(b"".join(replies))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # Client went away or the server is shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """
+        Start listening. Returns once the server is bound
+        """
+        self._server = await asyncio.start_server(self._client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start(self):
+        """
+        Run the server on its own event loop in a daemon thread
+
+        Returns
+        -------
+        (host, port) : tuple
+            address the server is listening on
+        """
+        ready = threading.Event()
+
+        def _run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.serve())
+            ready.set()
+            self._loop.run_forever()
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=_run, name="PTSimulator", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return (self.host, self.port)
+
+    def stop(self):
+        """
+        Stop a server started with `start`
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake FLIR pan and tilt server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--latency", type=float, default=0, help="seconds per reply packet")
+    parser.add_argument("--jitter", type=float, default=0, help="max extra seconds per reply packet")
+    args = parser.parse_args()
+    sim = PTSimulator(args.host, args.port, args.latency, args.jitter)
+
+    async def _forever():
+        server = await sim.serve()
+        print("Listening on %s:%d" % (sim.host, sim.port))
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
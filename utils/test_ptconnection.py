@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import socket
+
+import pytest
+
+from pyflirpt.utils import ptconnection
+
+
+@pytest.fixture
+def connection(simulator):
+    conn = ptconnection.PTConnection(simulator.host, simulator.port, timeout=2)
+    yield conn
+    conn.close()
+
+
+def _drop(conn):
+    conn.reader.sock.shutdown(socket.SHUT_RDWR)
+
+
+def test_replies_one_line_per_command(connection):
+    assert connection.execute("PP100 TP-20") == b"*\r\n*\r\n"
+    assert connection.execute("PP") == b"* Current Pan position is 0\r\n"
+
+
+def test_idempotent_command_resent_after_drop(connection):
+    connection.execute("B")
+    _drop(connection)
+    assert connection.execute("PP").startswith(b"* Current Pan position")
+
+
+def test_non_idempotent_command_not_resent(connection, simulator):
+    connection.execute("B")
+    _drop(connection)
+    sent = simulator.commands
+    with pytest.raises(IOError):
+        connection.execute("PO10")
+    # The relative move was not replayed on a new connection
+    assert simulator.commands == sent
+
+
+def test_pool_rejects_conflicting_settings(simulator):
+    try:
+        first = ptconnection.get_connection(simulator.host, simulator.port, timeout=2)
+        assert ptconnection.get_connection(simulator.host, simulator.port, timeout=2) is first
+        with pytest.raises(ValueError):
+            ptconnection.get_connection(simulator.host, simulator.port, timeout=3)
+    finally:
+        ptconnection.close_all()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from pyflirpt.utils import ptconnection, ptmetrics
+from pyflirpt.utils.ptdispatcher import CommandDispatcher
+
+
+class GatedSender(object):
+    """
+    Sends to the simulator, holding every send until `gate` is set
+    """
+    def __init__(self, simulator):
+        self.conn = ptconnection.PTConnection(simulator.host, simulator.port, timeout=2)
+        self.sent = []
+        self.started = threading.Event()
+        self.gate = threading.Event()
+
+    def __call__(self, commands):
+        self.started.set()
+        self.gate.wait(5)
+        self.sent.append(commands)
+        return self.conn.execute(commands)
+
+
+@pytest.fixture
+def sender(simulator):
+    sender = GatedSender(simulator)
+    yield sender
+    sender.gate.set()
+    sender.conn.close()
+
+
+def test_halt_preempts_queued_motion(sender):
+    metrics = ptmetrics.Registry(enabled=True)
+    dispatcher = CommandDispatcher(sender, metrics=metrics)
+    try:
+        dispatcher.request("B")
+        sender.started.wait(5)
+        motion = dispatcher.move(["PP100", "TP50"])
+        control = dispatcher.request("PP")
+        assert metrics.gauges[("pt_queue_depth", (("queue", "dispatcher"),))] == 3
+        dispatcher.halt()
+        assert metrics.gauges[("pt_queue_depth", (("queue", "dispatcher"),))] == 2
+        sender.gate.set()
+        assert control.result(5).startswith(b"*")
+        with pytest.raises(IOError):
+            motion.result(5)
+        assert dispatcher.flush(5)
+        assert sender.sent == ["B", "H", "PP"]
+    finally:
+        dispatcher.stop()
+
+
+def test_merged_speed_sent_before_position(sender, simulator):
+    dispatcher = CommandDispatcher(sender)
+    try:
+        dispatcher.request("B")
+        sender.started.wait(5)
+        dispatcher.move(["PP100"])
+        dispatcher.move(["PS500"])
+        ticket = dispatcher.move(["PP200"])
+        sender.gate.set()
+        ticket.result(5)
+        assert sender.sent == ["B", "PS500 PP200"]
+        assert simulator.pan_speed == 500
+    finally:
+        dispatcher.stop()
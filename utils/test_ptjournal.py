@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from pyflirpt.utils import ptjournal
+
+
+def test_compare_groups_batches_by_every_command(capsys):
+    entry = ptjournal.Entry
+    results = [(entry(0.0, 0.010, 0, b"PP10", b"*\r\n"), 0.001),
+               (entry(1.0, 1.020, 0, b"PP20 TP5", b"*\r\n*\r\n"), 0.002),
+               (entry(2.0, 2.030, 0, b"PP30\nTP6", b"*\r\n*\r\n"), 0.003)]
+    ptjournal.compare(results)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1].startswith("PP ") and lines[2].startswith("PP TP ")
+    assert lines[2].split()[2] == "2"
+    # The newline of a batched command stays on one line
+    assert "'PP30\\nTP6'" in lines[4]
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from pyflirpt.utils import ptlogger
+
+
+def test_asynchronous_falls_back_to_synchronous_handlers(monkeypatch):
+    monkeypatch.setattr(ptlogger, "ASYNC_SUPPORTED", False)
+    logger = ptlogger.ptlogger("test_ptlogger_fallback", asynchronous=True)
+    assert "test_ptlogger_fallback" not in ptlogger._listeners
+    assert [type(handler) for handler in logger.handlers] == [logging.StreamHandler]
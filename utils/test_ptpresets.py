@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from pyflirpt.utils.ptpresets import PresetStore, _STOP
+
+
+def _rows(path):
+    with open(path) as p_handler:
+        return [line for line in p_handler.read().splitlines() if line]
+
+
+def test_changes_written_behind_and_reloaded(tmp_path):
+    path = str(tmp_path / "presets.csv")
+    store = PresetStore(path)
+    store.set(1, 100, -50)
+    store.set(2, 200, 10)
+    store.flush()
+    assert _rows(path) == ['1,"100,-50"', '2,"200,10"']
+    store.close()
+    assert PresetStore(path).get(1) == (100, -50)
+
+
+def test_compacted_on_open_before_new_changes(tmp_path):
+    path = str(tmp_path / "presets.csv")
+    with open(path, "w") as p_handler:
+        p_handler.write('1,"1,1"\r\n1,"2,2"\r\n2,"3,3"\r\n')
+    store = PresetStore(path)
+    store.set(3, 4, 4)
+    store.close()
+    assert _rows(path) == ['1,"2,2"', '2,"3,3"', '3,"4,4"']
+
+
+def test_task_done_once_per_item(tmp_path):
+    store = PresetStore(str(tmp_path / "presets.csv"))
+    store.close()
+    for item in [("1", 1, 1), _STOP, _STOP]:
+        store._queue.put(item)
+    # Drain the three items in a single batch on this thread
+    store._run()
+    assert store._queue.unfinished_tasks == 0